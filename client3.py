@@ -21,9 +21,10 @@
 #
 ################################################################################
 
-import sys,socket,select,argparse,time,traceback,getpass,ssl
+import sys,argparse,time,traceback,getpass
 from threading import Thread,Event
-from queue import Queue
+
+from lib.socketclient import SocketClient,ClientError,TimeoutError
 
 readline = None
 
@@ -43,6 +44,10 @@ def main():
       default='localhost:8767',
       help='host:port to connect to',
       metavar='HOST')
+  parser.add_argument('-u','--unix',
+      default=None,
+      help="connect to the bot's Unix socket instead of host:port",
+      metavar='PATH')
   parser.add_argument('-t','--timestamp',
       action='store_true',
       help='include time stamps')
@@ -55,6 +60,11 @@ def main():
   parser.add_argument('-s','--ssl',
       action='store_true',
       help='use ssl')
+  parser.add_argument('-c','--cache',
+      default='~/.sibyl_sessions',
+      help="file to save SSL sessions in so later connections can resume "
+          +"them ('' to disable)",
+      metavar='PATH')
   parser.add_argument('-r','--noreadline',
       action='store_true',
       help="don't use GNU readline")
@@ -67,6 +77,9 @@ def main():
   parser.add_argument('-d','--debug',
       action='store_true',
       help='print debug info (depends -d)')
+  parser.add_argument('-z','--compress',
+      action='store_true',
+      help='ask the server to compress large messages')
   parser.add_argument('-w','--timeout',
       default=15,type=int,
       help='timeout in sec (depends -d)')
@@ -91,62 +104,96 @@ def main():
     CLI(args).run()
 
 ###############################################################################
-# One-off shell command class
+# Helper functions
 ###############################################################################
 
-class TimeoutError(Exception):
-  pass
+# @param chat (object) a Shell, CLI, or QtClient with args, say(), and log()
+# @param pword (str) the password to send, or None
+# @return (SocketClient) a client set up from chat.args that reports to chat
+def new_client(chat,pword):
+
+  args = chat.args
+  if args.noverify and not args.ssl:
+    chat.log('Ignoring option --noverify (not using ssl)')
+  if args.unix and args.ssl:
+    chat.log('Ignoring option --ssl (using a Unix socket)')
+
+  (host,port) = (args.host,8767)
+  if ':' in host:
+    (host,port) = host.split(':')
+  elif not args.unix:
+    chat.log('No port specified; using default 8767')
+
+  client = SocketClient(host,int(port),args.unix,pword,args.ssl,
+      not args.noverify,args.cache,args.compress,args.timeout)
+  client.on_message = chat.say
+  client.on_log = chat.log
+  return client
+
+# @param chat (object) a Shell, CLI, or QtClient with log() and error()
+# @param client (SocketClient) the client to connect
+# @return (bool) True if we connected
+def connect(chat,client):
+
+  try:
+    client.connect()
+  except ClientError as e:
+    if 'CERTIFICATE_VERIFY_FAILED' in str(e):
+      chat.log('If the server certificate is self-signed, try again with -v')
+    chat.error(str(e))
+    return False
+  return True
+
+###############################################################################
+# One-off shell command class
+###############################################################################
 
 class Shell(object):
 
   def __init__(self,args):
 
     self.args = args
-    self.send_queue = Queue()
-    self.event_close = Event()
-    self.pword = self.args.password
     self.delim = 'DONE_%s_%s' % (time.time(),hash(time.time()))
     self.response = []
     self.errors = False
 
   def run(self):
 
-    socket = SocketThread(self)
-    socket.connect()
-    socket.start()
-
-    cmd = self.args.execute or sys.stdin.read()
-    self.send_queue.put(cmd)
-    self.send_queue.put('echo '+self.delim)
-    start = time.time()
-
-    try:
-      while (not self.response
-          or self.delim not in [x[1] for x in self.response]):
-        if time.time()-start>self.args.timeout:
-          raise TimeoutError
-        time.sleep(0.1)
-    except TimeoutError:
-      self.error('Timed out waiting for response.')
-    except KeyboardInterrupt:
-      pass
-    except BaseException as e:
-      print(traceback.format_exc(e))
-
-    self.event_close.set()
-    if socket.is_alive():
-      socket.join()
+    client = new_client(self,self.args.password)
+    if connect(self,client):
+      cmd = self.args.execute or sys.stdin.read()
+      self.execute(client,cmd)
+      client.close()
 
     for (err,s) in self.response:
       if err:
         sys.stderr.write(s+'\n')
         sys.stderr.flush()
-      elif s!=self.delim:
+      else:
         print(s)
 
     if self.errors:
       sys.exit(1)
 
+  def execute(self,client,cmd):
+    """run cmd and wait until the bot has replied"""
+
+    def done(future):
+      if not future.exception():
+        self.say(future.result())
+
+    # bots don't reply to every command, but they do run them in order, so
+    # once the echo comes back the command has replied if it's going to
+    client.submit(cmd).add_done_callback(done)
+    try:
+      client.call('echo '+self.delim,self.args.timeout)
+    except TimeoutError:
+      self.error('Timed out waiting for response.')
+    except ClientError as e:
+      self.error(str(e))
+    except KeyboardInterrupt:
+      pass
+
   def say(self,s):
 
     self.response.append((False,s))
@@ -160,7 +207,6 @@ class Shell(object):
 
     self.response.append((True,'  ### '+txt))
     self.errors = True
-    self.response.append((False,self.delim))
 
 ################################################################################
 # CLI class
@@ -171,18 +217,17 @@ class CLI(object):
   def __init__(self,args):
 
     self.args = args
-    self.send_queue = Queue()
     self.event_close = Event()
+    self.client = None
 
   def run(self):
 
-    self.pword = self.get_pass()
-
-    socket = SocketThread(self)
-    socket.connect()
-    socket.start()
+    pword = self.get_pass()
+    self.client = new_client(self,pword)
+    self.client.on_close = self.closed
+    if not connect(self,self.client):
+      return
 
-    time.sleep(1)
     print('')
     BufferThread(self).start()
 
@@ -191,12 +236,24 @@ class CLI(object):
         time.sleep(0.1)
     except (KeyboardInterrupt,SystemExit):
       pass
-    except BaseException:
+    except BaseException as e:
       print(traceback.format_exc())
 
+    self.client.close()
+
+  def send(self,text):
+
+    try:
+      self.client.send(text)
+    except ClientError as e:
+      self.error(str(e))
+
+  # @param error (ClientError) why the connection closed, or None
+  def closed(self,error):
+
+    if error:
+      self.error(str(error))
     self.event_close.set()
-    if socket.is_alive():
-      socket.join()
 
   def say(self,s):
 
@@ -220,7 +277,7 @@ class CLI(object):
   def error(self,txt):
 
     print('  ### '+txt)
-    sys.exit(0)
+    self.event_close.set()
 
   def get_pass(self):
 
@@ -231,185 +288,6 @@ class CLI(object):
     print('')
     return pword
 
-################################################################################
-# SocketThread class
-################################################################################
-
-class SocketThread(Thread):
-
-  MSG_AUTH = '0'
-  MSG_TEXT = '1'
-
-  AUTH_OKAY = 'OKAY'
-  AUTH_FAILED = 'FAILED'
-  AUTH_NONE = 'NONE'
-
-  def __init__(self,chat):
-    """create a new thread that reads from stdin and appends to a Queue"""
-
-    super(SocketThread,self).__init__()
-    self.daemon = True
-    self.auth_sent = False
-
-    self.chat = chat
-    self.buffer = ''
-
-  def connect(self):
-
-    success = False
-
-    if self.chat.args.noverify and not self.chat.args.ssl:
-      self.chat.log('Ignoring option --noverify (not using ssl)')
-
-    host = self.chat.args.host
-    if ':' not in host:
-      self.chat.log('No port specified; using default 8767')
-      host += ':8767'
-    (host,port) = host.split(':')
-    port = int(port)
-    sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-
-    if self.chat.args.ssl:
-      context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-      if not self.chat.args.noverify:
-        context.verify_mode = ssl.CERT_REQUIRED
-        context.check_hostname = True
-        context.load_default_certs()
-      context.options |= (ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3)
-      sock = context.wrap_socket(sock,server_hostname=host)
-      try:
-        sock.connect((host,port))
-        self.chat.log('SSL Successful')
-        success = True
-      except ssl.SSLEOFError:
-        sock.close()
-        self.chat.error('SSL handshake failed; does the server support it?')
-      except ssl.SSLError as e:
-        if e.reason=='CERTIFICATE_VERIFY_FAILED':
-          self.chat.log('If the server certificate is self-signed, '
-              + 'try again with -v')
-        self.chat.error('SSL failed because: %s' % e.reason)
-      except socket.error as e:
-        self.chat.error('Socket error: %s' % e.strerror)
-    else:
-      try:
-        sock.connect((host,port))
-        success = True
-      except socket.error as e:
-        self.chat.error('Socket error: %s' % e.strerror)
-
-    if success:
-      self.sock = sock
-      self.chat.log('Connected')
-
-    return success
-
-  def run(self):
-    """receive and send data on the socket"""
-
-    if self.chat.pword:
-      self.do_auth()
-    self.send_msg(' ')
-
-    while not self.chat.event_close.is_set():
-      (read,write,err) = select.select([self.sock],[self.sock],[],1)
-
-      if self.sock in read:
-        try:
-          msgs = self.get_msgs()
-        except SystemExit:
-          break
-        except:
-          self.chat.error('EXCEPTION\n\n'+traceback.format_exc())
-          break
-        for msg in msgs:
-          if msg:
-            self.chat.say(msg)
-
-      if self.sock in write:
-        while not self.chat.send_queue.empty():
-          self.send_msg(self.chat.send_queue.get())
-
-      time.sleep(0.1)
-
-    try:
-      self.sock.shutdown(socket.SHUT_RDWR)
-    except:
-      pass
-    self.sock.close()
-    self.chat.log('Disconnected')
-
-  def die(self,msg):
-
-    self.chat.event_close.set()
-    self.chat.error(msg)
-
-  def get_msgs(self):
-
-    msgs = []
-    while self.buffer or not msgs:
-      (typ,msg) = self.get_msg()
-      if typ==SocketThread.MSG_AUTH:
-        self.check_auth(msg)
-        msgs.append(None)
-      elif typ==SocketThread.MSG_TEXT or typ is None:
-        msgs.append(msg)
-      else:
-        self.die('Unsupported msg type "%s"; closing connection' % typ)
-
-    return msgs
-
-  def get_msg(self):
-
-    msg = self.buffer
-    while ' ' not in msg:
-      s = self.sock.recv(4096).decode('utf8')
-      if not s:
-        self.die('Remote closed connection')
-        return (None,None)
-      msg += s
-
-    length_str = msg.split(' ')[0]
-    target = len(length_str)+1+int(length_str)
-    while len(msg)<target:
-      msg += self.chat.sock.recv(min(target-len(msg),4096))
-
-    (msg,self.buffer) = (msg[:target],msg[target:])
-    msg = msg[msg.find(' ')+1:]
-    return (msg[0],msg[2:])
-
-  def do_auth(self):
-
-    self.send_msg(self.chat.pword,SocketThread.MSG_AUTH)
-    self.auth_sent = True
-
-  def check_auth(self,msg):
-
-    if not self.auth_sent:
-      self.die('Server requires a password')
-      return
-
-    if msg==SocketThread.AUTH_OKAY:
-      self.chat.log('Authenticated')
-    elif msg==SocketThread.AUTH_FAILED:
-      self.die('Invalid password')
-    elif msg==SocketThread.AUTH_NONE:
-      self.chat.log('Server does not require a password')
-    else:
-      self.die('Received invalid Auth response from server')
-
-  def send_msg(self,msg,typ=None):
-
-    typ = SocketThread.MSG_TEXT if typ is None else typ
-    msg = typ+' '+msg
-    length_str = str(len(msg))
-    msg = str(length_str+' '+msg).encode('utf8')
-    target = len(msg)
-
-    sent = 0
-    while sent<target:
-      sent += self.sock.send(msg[sent:])
-
 ################################################################################
 # BufferThread class
 ################################################################################
@@ -417,7 +295,7 @@ class SocketThread(Thread):
 class BufferThread(Thread):
 
   def __init__(self,chat):
-    """create a new thread that reads from stdin and appends to a Queue"""
+    """create a new thread that reads from stdin and sends each line"""
 
     super(BufferThread,self).__init__()
     self.daemon = True
@@ -425,41 +303,52 @@ class BufferThread(Thread):
     self.chat = chat
 
   def run(self):
-    """read from stdin, add to the queue, set the event_data Event"""
+    """read from stdin and send each line to the bot"""
 
     while not self.chat.event_close.is_set():
       s = ((time.asctime()+' | ') if self.chat.args.timestamp else '')+USER+': '
       sys.stdout.write(s)
-      s = input()
-      self.chat.send_queue.put(s)
+      try:
+        s = input()
+      except EOFError:
+        break
+      self.chat.send(s)
+    self.chat.event_close.set()
 
 ################################################################################
 # Qt signal bridge class
 ################################################################################
 
 if 'QtCore' in locals():
-  class QtSocketThread(QtCore.QObject):
+  class QtClient(QtCore.QObject):
 
     sig_say = QtCore.pyqtSignal(str)
     sig_log = QtCore.pyqtSignal(str)
     sig_err = QtCore.pyqtSignal(str)
 
     def __init__(self,gui):
+      """pass SocketClient callbacks (from its I/O thread) to the GUI"""
 
-      super(QtSocketThread,self).__init__()
-      self.gui = gui
+      super(QtClient,self).__init__()
       self.args = gui.args
-      self.pword = gui.pword
-
-      self.send_queue = Queue()
-      self.event_close = Event()
-      self.socket = SocketThread(self)
+      self.client = new_client(self,gui.pword)
+      self.client.on_close = self.closed
 
     def connect(self):
-      return self.socket.connect()
+      return connect(self,self.client)
+
+    def send(self,txt):
+      try:
+        self.client.send(txt)
+      except ClientError as e:
+        self.error(str(e))
+
+    def close(self):
+      self.client.close()
 
-    def run(self):
-      self.socket.run()
+    def closed(self,error):
+      if error:
+        self.error(str(error))
 
     def say(self,txt):
       self.sig_say.emit(txt)
@@ -485,7 +374,6 @@ if 'QtGui' in locals():
       self.connected = False
 
       self.worker = None
-      self.thread = None
 
       self.initUI()
       self.center()
@@ -562,7 +450,7 @@ if 'QtGui' in locals():
         self.start_thread()
       elif t=='Disconnect':
         if self.worker:
-          self.worker.event_close.set()
+          self.worker.close()
           self.connected = False
       elif t=='Copy HTML':
         QApplication.clipboard().setText(self.chatpane.toHtml())
@@ -580,36 +468,30 @@ if 'QtGui' in locals():
           text = text.replace('\n','')
           if text:
             self.said(text)
-            self.worker.send_queue.put(text)
+            self.worker.send(text)
           self.editpane.clear()
         else:
           self.editpane.textCursor().deletePreviousChar()
 
     def start_thread(self):
 
-      worker = QtSocketThread(self)
-      thread = QtCore.QThread(self)
-      worker.moveToThread(thread)
-      thread.started.connect(worker.run)
-
+      self.cleanup()
+      worker = QtClient(self)
       worker.sig_say.connect(self.say)
       worker.sig_log.connect(self.log)
       worker.sig_err.connect(self.error)
 
       if worker.connect():
         self.connected = True
-        thread.start()
-        self.thread = thread
         self.worker = worker
       else:
         self.log('Disconnected')
 
     @QtCore.pyqtSlot()
     def cleanup(self):
-      if self.worker and not self.worker.event_close.is_set():
-        self.worker.event_close.set()
-        if self.thread.isRunning():
-          self.thread.wait()
+      if self.worker:
+        self.worker.close()
+        self.worker = None
 
     def said(self,txt):
       self.chat('%s: %s' % (USER,txt))
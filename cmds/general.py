@@ -21,7 +21,7 @@
 ################################################################################
 
 import sys,os,subprocess,json,socket,re,codecs,math,time
-from collections import OrderedDict
+from collections import OrderedDict,deque
 
 import requests
 
@@ -153,7 +153,7 @@ def alias_cb(bot,mess,args,name):
       if name in bot.aliases:
         msg = alias_cb(bot,mess,args,name)
       elif bot.which(name):
-        msg = bot.run_cmd(name,args=(n[1:]+args),mess=mess)
+        msg = bot.run_cmd(name,args=(n[1:]+args),mess=mess,stream=True)
       else:
         msg = 'Unknown command "%s"' % name
       if msg:
@@ -566,15 +566,18 @@ def _log(bot,mess,args):
     if len(args)>1:
       r = ' '.join(args[1:])
 
-    # return n lines matching regex
+    # keep only the last n lines matching regex instead of the whole file
     with open(bot.opt('log_file'),'r') as f:
-      lines = f.readlines()
-    if r:
-      lines = [l for l in lines if re.search(r,l)]
-    lines = lines[-n:]
-    if not bot.opt('general.log_time'):
-      lines = [(l[l.find('|')+2:] if l.find('|') else l) for l in lines]
-    return ''.join(lines[:n])
+      lines = (l for l in f if re.search(r,l)) if r else f
+      lines = deque(lines,maxlen=(n if n>0 else None))
+
+    # stream the lines back instead of building one huge reply
+    def tail():
+      for l in lines:
+        if not bot.opt('general.log_time'):
+          l = (l[l.find('|')+2:] if l.find('|') else l)
+        yield l.rstrip('\n')
+    return tail()
 
   # return the last traceback
   elif args[0]=='trace':
@@ -224,7 +224,7 @@ def search(bot,mess,args):
   if len(matches)>1:
     maxm = bot.opt('library.max_matches')
     if maxm<1 or len(matches)<=maxm:
-      return 'Found '+str(len(matches))+' matches: '+util.list2str(matches)
+      return iter(['Found '+str(len(matches))+' matches: ']+matches)
     else:
       return 'Found '+str(len(matches))+' matches'
 
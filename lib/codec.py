@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# Framing for the socket protocol, shared by protocols/sibyl_socket.py and the
+# client.py/client3.py clients, so this file must run on python 2 and 3. Every
+# message on the wire is "<length> <typ> <msg>" where length is the number of
+# bytes in "<typ> <msg>" and typ is a single character.
+#
+# Decoder reads into one reusable bytearray and copies each message out of it
+# exactly once; Encoder queues header and body buffers separately and sends
+# them with memoryview slices, so large messages are never re-copied.
+#
+# Once both ends have agreed to it, a message can be sent as a ZLIB frame whose
+# body is the zlib-compressed "<typ> <msg>" of the original frame. Decoder
+# always inflates these, so callers never see the ZLIB type.
+#
+################################################################################
+
+import itertools,zlib
+from collections import deque
+
+# bodies smaller than this are joined to their header so they go out in one
+# send() call; larger ones are queued as-is to avoid copying them
+JOIN_SIZE = 16384
+
+# message type for compressed frames, and the most we'll inflate one to
+ZLIB = 'z'
+MAX_INFLATE = 64*1024*1024
+
+# zlib level; text compresses nearly as well at 1 and it's much faster
+ZLIB_LEVEL = 1
+
+class FrameError(Exception):
+  pass
+
+# @param msg (str,unicode,bytes) the message body (unicode is sent as UTF-8)
+# @param typ (str) a single character message type
+# @param compress (int) [0] compress bodies at least this big (0 = never)
+# @return (tuple of bytes) the frame header and body, ready for Encoder.extend()
+def encode(msg,typ,compress=0):
+
+  if not isinstance(msg,bytes):
+    msg = msg.encode('utf8')
+
+  # only keep the compressed version if it actually saved something
+  if compress and len(msg)>=compress:
+    body = zlib.compress(typ.encode('ascii')+b' '+msg,ZLIB_LEVEL)
+    if len(body)<len(msg):
+      (msg,typ) = (body,ZLIB)
+
+  header = ('%d %s ' % (len(msg)+len(typ)+1,typ)).encode('ascii')
+  if len(msg)<JOIN_SIZE:
+    return (header+msg,)
+  return (header,msg)
+
+# @param body (bytes) the body of a ZLIB frame
+# @return (tuple) the (typ,msg) of the original frame
+# @raise (FrameError) if the body is corrupt or inflates to over MAX_INFLATE
+def inflate(body):
+
+  z = zlib.decompressobj()
+  try:
+    data = z.decompress(body,MAX_INFLATE)
+  except zlib.error:
+    raise FrameError('Invalid compressed message')
+  if z.unconsumed_tail:
+    raise FrameError('Compressed message too large')
+
+  if len(data)<2 or data[1:2]!=b' ':
+    raise FrameError('Invalid compressed message')
+  typ = chr(bytearray(data[:1])[0])
+  if typ==ZLIB:
+    raise FrameError('Invalid compressed message')
+  return (typ,data[2:])
+
+################################################################################
+# Decoder class
+################################################################################
+
+class Decoder(object):
+
+  # @param size (int) [4096] initial buffer size (it grows to fit large msgs)
+  def __init__(self,size=4096):
+
+    self.buf = bytearray(size)
+    self.start = 0
+    self.end = 0
+    self.need = 0
+
+  # @param sock (socket) the socket to read from
+  # @return (int) the number of bytes read (0 means the socket is closed)
+  # @raise (socket.error) from sock.recv_into() e.g. EAGAIN if non-blocking
+  def recv_into(self,sock):
+    """read as much as fits into the free end of our buffer"""
+
+    n = max(self.need,4096)
+    if len(self.buf)-self.end<n:
+      self.__reserve(n)
+
+    # the buffer is usually empty, in which case we don't need a memoryview
+    if self.end:
+      n = sock.recv_into(memoryview(self.buf)[self.end:])
+    else:
+      n = sock.recv_into(self.buf)
+    self.end += n
+    return n
+
+  # @return (int) the number of unparsed bytes in the buffer
+  def pending(self):
+
+    return self.end-self.start
+
+  # @return (list of tuple) (typ,msg) tuples with typ as str, msg as bytes
+  # @raise (FrameError) if the stream contains an invalid length
+  def frames(self):
+    """parse every complete message currently in the buffer"""
+
+    (buf,start,stop) = (self.buf,self.start,self.end)
+    frames = []
+    while True:
+      i = buf.find(b' ',start,stop)
+      if i<0:
+        if stop-start>20:
+          raise FrameError('Missing message length')
+        break
+
+      try:
+        length = int(buf[start:i])
+      except ValueError:
+        raise FrameError('Invalid message length')
+      if length<1:
+        raise FrameError('Invalid message length')
+
+      end = i+1+length
+      if end>stop:
+        self.need = end-start
+        break
+      self.need = 0
+
+      # small copies are cheaper than creating a memoryview
+      if length>JOIN_SIZE:
+        msg = memoryview(buf)[i+3:end].tobytes()
+      else:
+        msg = bytes(buf[i+3:end])
+      typ = chr(buf[i+1])
+      start = end
+
+      if typ==ZLIB:
+        (typ,msg) = inflate(msg)
+      frames.append((typ,msg))
+
+    if start==stop:
+      self.start = self.end = 0
+    else:
+      self.start = start
+    return frames
+
+  def __reserve(self,n):
+    """make room for at least n bytes after self.end"""
+
+    # slide unparsed bytes to the front, then grow if that isn't enough
+    left = self.end-self.start
+    if self.start:
+      self.buf[:left] = self.buf[self.start:self.end]
+      (self.start,self.end) = (0,left)
+    if len(self.buf)-self.end<n:
+      self.buf.extend(bytearray(max(n-(len(self.buf)-self.end),len(self.buf))))
+
+################################################################################
+# Encoder class
+################################################################################
+
+class Encoder(object):
+
+  # @param compress (int) [0] compress bodies at least this big (0 = never)
+  def __init__(self,compress=0):
+
+    self.bufs = deque()
+    self.size = 0
+    self.gather = None
+    self.compress = compress
+
+  # @param msg (str,unicode,bytes) the message body
+  # @param typ (str) a single character message type
+  def put(self,msg,typ):
+    """queue a message to be sent"""
+
+    self.extend(encode(msg,typ,self.compress))
+
+  # @param bufs (tuple of bytes) buffers from encode()
+  def extend(self,bufs):
+    """queue pre-encoded buffers to be sent"""
+
+    for b in bufs:
+      if b:
+        self.bufs.append(b)
+        self.size += len(b)
+
+  # @return (int) the number of bytes waiting to be sent
+  def pending(self):
+
+    return self.size
+
+  # @param sock (socket) the socket to send on
+  # @raise (socket.error) from sock.send() e.g. EAGAIN if non-blocking
+  def send(self,sock):
+    """send as much as the socket will take"""
+
+    # gather writes need sendmsg (python 3, and not over SSL)
+    if self.gather is None:
+      self.gather = (hasattr(sock,'sendmsg') and not hasattr(sock,'pending'))
+
+    bufs = self.bufs
+    while bufs:
+      if self.gather and len(bufs)>1:
+        sent = sock.sendmsg(list(itertools.islice(bufs,64)))
+      else:
+        sent = sock.send(bufs[0])
+      self.size -= sent
+
+      # drop whatever was fully sent and slice the first partial buffer
+      while sent:
+        n = len(bufs[0])
+        if sent<n:
+          bufs[0] = memoryview(bufs[0])[sent:]
+          break
+        bufs.popleft()
+        sent -= n
@@ -83,11 +83,15 @@ class Config(object):
 ('catch_except',(True,                False,  self.parse_bool,      None,               None,             None,     None)),
 ('help_plugin', (False,               False,  self.parse_bool,      None,               None,             None,     None)),
 ('recon_wait',  (60,                  False,  self.parse_int,       None,               None,             None,     None)),
+('recon_max',   (3600,                False,  self.parse_int,       self.valid_nump,    None,             None,     None)),
+('recon_jitter',(0.1,                 False,  self.parse_float,     self.valid_nump,    None,             None,     None)),
+('recon_count', (0,                   False,  self.parse_int,       self.valid_nump,    None,             None,     None)),
 ('kill_stdout', (True,                False,  self.parse_bool,      None,               None,             None,     None)),
 ('tell_errors', (True,                False,  self.parse_bool,      None,               None,             None,     None)),
 ('admin_protos',(['cli'],             False,  self.parse_admin,     self.valid_admin,   None,             None,     None)),
 ('persistence', (True,                False,  self.parse_bool,      None,               None,             None,     None)),
 ('state_file',  ('data/state.pickle', False,  None,                 self.valid_wfile,   None,             None,     None)),
+('ingress_budget',(20,                False,  self.parse_int,       self.valid_nump,    None,             None,     None)),
 ('idle_time',   (0.1,                 False,  self.parse_float,     self.valid_nump,    None,             None,     None)),
 ('idle_count',  (5,                   False,  self.parse_int,       self.valid_nump,    None,             None,     None)),
 ('idle_freq',   (1,                   False,  self.parse_int,       self.valid_nump,    None,             None,     None)),
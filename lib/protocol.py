@@ -32,7 +32,7 @@
 ################################################################################
 
 from abc import ABCMeta,abstractmethod
-import os,sys,inspect
+import os,sys,inspect,collections
 
 ################################################################################
 # Custom exceptions
@@ -253,6 +253,16 @@ class Room(object):
 # Message class
 ################################################################################
 
+# @param text (object) text or an object to convert to text
+# @return (unicode) the text, decoding str as UTF-8
+def to_unicode(text):
+
+  if isinstance(text,str):
+    return text.decode('utf8')
+  elif not isinstance(text,unicode):
+    return unicode(text)
+  return text
+
 class Message(object):
 
   # Type enums
@@ -287,8 +297,9 @@ class Message(object):
   # @param broadcast (bool) [False] highlight all users (only works for Rooms)
   # @param users (list of User) [[]] additional users to highlight (broadcast)
   # @param hook (bool) [True] execute @botsend hooks for this message
+  # @param stream (iterator) [None] lines to send in place of txt
   def __init__(self,user,txt,typ=None,status=None,msg=None,room=None,
-      to=None,broadcast=False,users=None,hook=True,emote=False):
+      to=None,broadcast=False,users=None,hook=True,emote=False,stream=None):
     """create a new Message"""
 
     self.protocol = user.get_protocol() if to is None else to.get_protocol()
@@ -312,6 +323,7 @@ class Message(object):
     self.users = users or []
     self.hook = hook
     self.emote = emote
+    self.stream = stream
 
   # @return (User,Room) the sender of this Message usable for a reply
   def get_from(self):
@@ -337,11 +349,7 @@ class Message(object):
   def set_text(self,text):
     """set the body of the message"""
 
-    if isinstance(text,str):
-      text = text.decode('utf8')
-    elif not isinstance(text,unicode):
-      text = unicode(text)
-    self.txt = text
+    self.txt = to_unicode(text)
 
   # @return (int) the type of this Message (Message class type enum)
   def get_type(self):
@@ -383,6 +391,19 @@ class Message(object):
     """return whether this Message was sent as an "emote" message"""
     return self.emote
 
+  # @return (iterator,None) the lines of a streamed reply, if this is one
+  def get_stream(self):
+    """return the iterator of lines for a streamed reply or None"""
+    return self.stream
+
+  # for protocols that can't stream, turn the whole stream into normal text
+  def join_stream(self):
+    """consume the stream into this Message's text"""
+
+    if self.stream is not None:
+      self.set_text('\n'.join([to_unicode(line) for line in self.stream]))
+      self.stream = None
+
   # @param typ (int) Message type enum
   # @return (str) human-readable Message type
   @staticmethod
@@ -418,9 +439,10 @@ class Protocol(object):
   def connect(self):
     pass
 
-  # receive/process messages and call bot._cb_message()
+  # receive/process messages and queue them with self.push_msg()
   # must ignore msgs from myself and from users not in any of our rooms
-  # @call bot._cb_message(Message) upon receiving a valid status or message
+  # @call self.push_msg(Message) upon receiving a valid status or message
+  # @return (bool) [optional] True if there's more work to do right away
   # @raise (PingTimeout) if implemented
   # @raise (ConnectFailure) if disconnected
   # @raise (ServerShutdown) if server shutdown
@@ -441,6 +463,14 @@ class Protocol(object):
   def send(self,mess):
     pass
 
+  # send a reply whose lines come from an iterator (see Message.get_stream())
+  # the default joins every line and calls self.send(); protocols that can
+  # deliver partial replies should override this and send lines as they go
+  # @param mess (Message) message to be sent
+  def send_stream(self,mess):
+    mess.join_stream()
+    self.send(mess)
+
   # send a message with text to every user in a room
   # optionally note that the broadcast was requested by a specific User
   # @param mess (Message) the message to broadcast
@@ -526,6 +556,7 @@ class Protocol(object):
     self.bot = bot
     self.log = log
     self.status = Protocol.INIT
+    self.__ingress = collections.deque()
 
     self.ProtocolError = type(
         'ProtocolError',
@@ -554,6 +585,23 @@ class Protocol(object):
   def __hash__(self):
     return hash(self.get_name())
 
+  # queue a received Message for the bot (this function is thread-safe)
+  # the bot hands queued messages to bot._cb_message() a few at a time
+  # @param mess (Message) the received message
+  def push_msg(self,mess):
+    self.__ingress.append(mess)
+
+  # @return (Message) the oldest queued Message, or None if there are none
+  def pop_msg(self):
+    try:
+      return self.__ingress.popleft()
+    except IndexError:
+      return None
+
+  # @return (int) the number of queued Messages waiting for the bot
+  def pending_msgs(self):
+    return len(self.__ingress)
+
   # @return (bool) True if we are connected to the server
   def is_connected(self):
     return self.status==Protocol.CONNECTED
@@ -38,6 +38,7 @@
 ################################################################################
 
 import sys,logging,re,os,imp,inspect,traceback,time,pickle,Queue,collections
+import random,threading
 
 from sibyl.lib.config import Config
 from sibyl.lib.protocol import Protocol,Message,Room,User
@@ -45,7 +46,7 @@ from sibyl.lib.protocol import (ProtocolError,PingTimeout,ConnectFailure,
     AuthFailure,ServerShutdown)
 from sibyl.lib.decorators import botcmd,botrooms,botcon
 import sibyl.lib.util as util
-from sibyl.lib.thread import SmartThread
+from sibyl.lib.thread import SmartThread,ConnectThread
 
 __author__ = 'Joshua Haas <haas.josh.a@gmail.com>'
 __version__ = 'v6.0.0'
@@ -136,6 +137,12 @@ class SibylBot(object):
     self.__finished = False
     self.__reboot = False
     self.__recons = {}
+    self.__recon_count = {}
+    self.__connecting = {}
+    self.__pending_cb = Queue.Queue()
+    self.__main_thread = None
+    self.__ingress_next = 0
+    self.__wake = threading.Event()
     self.__tell_rooms = []
     self.__pending_send = Queue.Queue()
     self.__deferred = []
@@ -622,6 +629,9 @@ class SibylBot(object):
   def _cb_join_room_success(self,room):
     """execute callbacks on successfull MUC join"""
 
+    if self.__off_main(self._cb_join_room_success,room):
+      return
+
     self.log.info('Success joining room "%s"' % room)
     self.__run_hooks('rooms',room)
 
@@ -630,6 +640,9 @@ class SibylBot(object):
   def _cb_join_room_failure(self,room,error):
     """execute callbacks on successfull MUC join"""
 
+    if self.__off_main(self._cb_join_room_failure,room,error):
+      return
+
     self.log.error('Error joining room "%s" (%s)' % (room,error))
     self.__run_hooks('roomf',room,error)
 
@@ -637,6 +650,39 @@ class SibylBot(object):
 # DDD - Helper functions
 ################################################################################
 
+  def __off_main(self,func,*args):
+    """queue a callback for the main loop if we aren't in the main thread"""
+
+    if self.__main_thread in (None,threading.current_thread()):
+      return False
+    self.__pending_cb.put((func,args))
+    return True
+
+  def __backoff(self,attempts):
+    """return seconds to wait before the given reconnect attempt"""
+
+    wait = min(self.opt('recon_wait')*2**(attempts-1),self.opt('recon_max'))
+    jitter = self.opt('recon_jitter')
+    return max(wait*(1+random.uniform(-jitter,jitter)),0)
+
+  def __proto_status(self,name):
+    """return a short human-readable connection status for a protocol"""
+
+    proto = self.protocols[name]
+    if proto.is_connected():
+      return 'connected'
+    elif proto.status==Protocol.DEAD:
+      return 'dead'
+    elif name in self.__connecting:
+      t = time.time()-self.__connecting[name].start_time
+      return 'connecting %ds' % t
+    elif name in self.__recons:
+      s = 'retry %s' % (self.__recon_count.get(name,0)+1)
+      if self.opt('recon_count'):
+        s += '/%s' % self.opt('recon_count')
+      return s+' in %ds' % max(self.__recons[name]-time.time(),0)
+    return 'init'
+
   def __get_cmd(self,mess):
     """return the body of mess with nick and prefix removed, or None"""
 
@@ -717,13 +763,27 @@ class SibylBot(object):
       frm = msg.get_from()
       if frm==frm.get_protocol().get_user():
         msg.user = None
+      msg.join_stream()
       msg.set_text(to.get_protocol().broadcast(msg) or '')
+    elif msg.get_stream() is not None:
+      to.get_protocol().send_stream(msg)
     else:
       to.get_protocol().send(msg)
 
     if msg.get_hook() and msg.get_text():
       self.__run_hooks('send',msg)
 
+  def __safe_stream(self,lines):
+    """log exceptions raised while a protocol consumes a streamed reply"""
+
+    try:
+      for line in lines:
+        yield line
+    except Exception as e:
+      self.__stats['ex'] += 1
+      self.log_ex(e,'Error while streaming reply:')
+      yield self.MSG_ERROR_OCCURRED
+
   def __match_user(self,mess,rule_str):
     """check if the black/white text matches protocol, user, room"""
 
@@ -922,18 +982,21 @@ class SibylBot(object):
 
     if not matches:
       return 'No matching errors'
-    return util.list2str(matches)
+    return iter(['']+matches)
 
   @staticmethod
   @botcmd(name='stats')
   def __stats_cmd(self,mess,args):
     """respond with some stats"""
 
+    protos = ', '.join(['%s (%s)' % (name,self.__proto_status(name))
+        for name in sorted(self.protocols)])
+
     return (('Born: %s --- Cmds-Run: %s --- Cmds-Forbid: %s --- ' +
-        'Cmds-Error: %s --- Disconnects: %s') %
+        'Cmds-Error: %s --- Disconnects: %s --- Protocols: %s') %
         (time.asctime(time.localtime(self.__stats['born'])),
         self.__stats['cmds'],self.__stats['forbid'],
-        self.__stats['ex'],self.__stats['discon']))
+        self.__stats['ex'],self.__stats['discon'],protos))
 
   @staticmethod
   @botcmd(name='uptime')
@@ -1038,26 +1101,97 @@ class SibylBot(object):
   def __serve(self):
     """process loop - connect and process messages"""
 
+    busy = False
     for (name,proto) in self.protocols.items():
 
       if proto.is_connected():
-        proto.process()
+        busy = proto.process() or busy
+
+      elif name in self.__connecting:
+        self.__check_connect(name)
 
       elif (proto.status!=Protocol.DEAD and
           ((name not in self.__recons) or (self.__recons[name]<time.time()))):
 
         self.__run_hooks('recon',name)
         proto.status = Protocol.CONNECTING
-        proto.connect()
-        proto.status = Protocol.CONNECTED
-        self.__run_hooks('con',name)
 
+        rooms = []
         for room in self.opt('rooms').get(name,[]):
           pword = room['pass'] and room['pass'].get()
-          proto.join_room(proto.new_room(room['room'],room['nick'],pword))
+          rooms.append(proto.new_room(room['room'],room['nick'],pword))
+
+        # connect in the background so one slow server can't stall the rest
+        self.log.debug('Connecting protocol "%s"' % name)
+        self.__connecting[name] = ConnectThread(self,proto,rooms)
+        self.__connecting[name].start()
+
+    self.__idle_cb()
+    return self.__ingress() or busy
+
+  def __ingress(self):
+    """handle queued messages round-robin; return True if any are left"""
+
+    # rotate the starting protocol every tick so nobody always goes first
+    protos = sorted(self.protocols.values(),key=lambda p:p.get_name())
+    if not protos:
+      return False
+    i = self.__ingress_next % len(protos)
+    self.__ingress_next = i+1
+    protos = protos[i:]+protos[:i]
+
+    budget = self.opt('ingress_budget')
+    done = dict.fromkeys(protos,0)
+    while protos:
+      for proto in protos[:]:
+        mess = None
+        if proto.is_connected() and (not budget or done[proto]<budget):
+          mess = proto.pop_msg()
+        if mess is None:
+          protos.remove(proto)
+          continue
+        done[proto] += 1
+        self._cb_message(mess)
+
+    return bool([p for p in self.protocols.values()
+        if p.is_connected() and p.pending_msgs()])
+
+  def __check_connect(self,name):
+    """finish a background connect or re-raise its exception"""
+
+    t = self.__connecting[name]
+    if t.is_alive():
+      return
+
+    del self.__connecting[name]
+    proto = self.protocols[name]
 
-        if name in self.__recons:
-          del self.__recons[name]
+    # let the except clauses in __run_forever() handle failures
+    if t.exc_info:
+      raise t.exc_info[0],t.exc_info[1],t.exc_info[2]
+
+    proto.status = Protocol.CONNECTED
+    self.__run_hooks('con',name)
+
+    if name in self.__recons:
+      del self.__recons[name]
+    if name in self.__recon_count:
+      del self.__recon_count[name]
+
+  def __idle_cb(self):
+    """run protocol callbacks queued from other threads"""
+
+    # hold room callbacks until their protocol has finished connecting
+    held = []
+    while not self.__pending_cb.empty():
+      (func,args) = self.__pending_cb.get()
+      if args[0].get_protocol().get_name() in self.__connecting:
+        held.append((func,args))
+      else:
+        func(*args)
+
+    for x in held:
+      self.__pending_cb.put(x)
 
   def __run_forever(self):
     """reconnect loop - catch known exceptions"""
@@ -1071,9 +1205,13 @@ class SibylBot(object):
     # try to reconnect forever unless self.quit()
     while not self.__finished:
       try:
-        self.__serve()
+        busy = self.__serve()
         self.__idle_proc()
-        time.sleep(0.1)
+
+        # only sleep if we've caught up on received messages
+        if not busy:
+          self.__wake.wait(0.1)
+          self.__wake.clear()
 
       except (PingTimeout,ConnectFailure,ServerShutdown,AuthFailure) as e:
 
@@ -1091,15 +1229,25 @@ class SibylBot(object):
 
         log_msg = 'Connection lost (%s); ' % reason
 
+        count = self.__recon_count.get(name,0)+1
+        self.__recon_count[name] = count
+        limit = self.opt('recon_count')
+
         if isinstance(e,AuthFailure):
           proto.status = Protocol.DEAD
           log_msg += 'disabling protocol'
-          if not self.protocols:
-            self.quit('No active protocols; exiting')
+        elif limit and count>=limit:
+          proto.status = Protocol.DEAD
+          log_msg += 'disabling protocol after %s attempts' % count
         else:
           proto.status = Protocol.DISCONNECTED
-          log_msg += 'reconnecting in %s sec' % self.opt('recon_wait')
-          self.__recons[name] = time.time()+self.opt('recon_wait')
+          wait = self.__backoff(count)
+          log_msg += 'reconnecting in %.1f sec (attempt %s)' % (wait,count+1)
+          self.__recons[name] = time.time()+wait
+
+        if not [p for p in self.protocols.values()
+            if p.status!=Protocol.DEAD]:
+          self.quit('No active protocols; exiting')
 
         proto.log.error(log_msg)
         if e.message:
@@ -1193,6 +1341,7 @@ class SibylBot(object):
     """run the bot catching any unhandled exceptions"""
 
     self.__status = SibylBot.RUNNING
+    self.__main_thread = threading.current_thread()
 
     # unfortunately xmpppy has a couple print statements, so kill stdout
     if self.opt('kill_stdout'):
@@ -1229,7 +1378,8 @@ class SibylBot(object):
     return self.__reboot
 
   # this function is thread-safe
-  # @param text (str,unicode) the text to send
+  # @param text (str,unicode,iterator) the text to send, or an iterator (e.g. a
+  #   generator) of lines that protocols may send as they're produced
   # @param to (User,Room) the recipient
   # @param broadcast (bool) [False] highlight all users (only works for Rooms)
   # @param frm (User) [None] the sending user (only relevant for broadcast)
@@ -1245,12 +1395,17 @@ class SibylBot(object):
     frm = (frm if broadcast else to.get_protocol().get_user())
     users = (users if broadcast else None)
 
+    stream = None
+    if isinstance(text,collections.Iterator):
+      (stream,text) = (self.__safe_stream(text),'')
+
     msg = Message(frm,text,
                   to=to,
                   broadcast=broadcast,
                   users=users,
                   hook=hook,
-                  emote=emote)
+                  emote=emote,
+                  stream=stream)
     self.__pending_send.put(msg)
 
   # wrapper method for send() allowing to pass Message objects instead of User
@@ -1275,6 +1430,12 @@ class SibylBot(object):
 
     return self.protocols[name]
 
+  # this function is thread-safe
+  def wake(self):
+    """cut the main loop's sleep short (e.g. a protocol has work to do)"""
+
+    self.__wake.set()
+
   # @param msg (str) [None] message to log
   def quit(self,msg=None):
     """Stop serving messages and exit"""
@@ -1328,8 +1489,9 @@ class SibylBot(object):
   # @param args (list) [None] arguments to pass to the command
   # @param mess (Message) [None] message to pass to the command
   # @param check_bw (bool) [True] enforce bw_list rules (if mess also supplied)
-  # @return (str,None) the result of the command
-  def run_cmd(self,cmd,args=None,mess=None,check_bw=True):
+  # @param stream (bool) [False] return streamed replies as-is, not joined
+  # @return (str,iterator,None) the result of the command
+  def run_cmd(self,cmd,args=None,mess=None,check_bw=True,stream=False):
     """run a chat command manually"""
 
     check_bw = (check_bw and mess)
@@ -1355,7 +1517,10 @@ class SibylBot(object):
 
     self.log.debug('  CMD: %s.%s via run_cmd() with %s' %
         (ns,cmd,applied))
-    return func(self,mess,args)
+    result = func(self,mess,args)
+    if isinstance(result,collections.Iterator) and not stream:
+      result = '\n'.join(result)
+    return result
 
   # @param msg (str) the message to log
   # @param ns (str) an identifier for the caller (e.g. plugin name)
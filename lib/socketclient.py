@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# A client for the socket protocol (protocols/sibyl_socket.py), used by
+# client.py/client3.py and importable by scripts, so this file must run on
+# python 2 and 3. For example:
+#
+#   with SocketClient('localhost',8767,password='secret') as bot:
+#     print(bot.call('uptime'))
+#     futures = [bot.submit('search %s' % x) for x in names]
+#
+# A SocketClient keeps one connection open and sends every command as a tagged
+# request, so any number of them can be in flight at once. submit() returns a
+# Future for the reply and call() waits for it. A reply is done when the server
+# sends its MSG_REQ frame; MSG_MORE frames before that are the earlier chunks
+# of a streamed reply. A command that never replies never finishes, so use a
+# timeout if you might run one.
+#
+# One I/O thread owns the socket, since an SSL socket can't be read and written
+# from two threads at once. Other threads queue frames and wake it with a pipe.
+# Callbacks (on_message, on_close, and Future callbacks) run in the I/O thread.
+#
+################################################################################
+
+import os,socket,select,errno,fcntl,ssl,itertools,threading
+
+from .codec import Decoder,Encoder,FrameError
+from .tlscache import SessionCache
+
+try:
+  from concurrent.futures import Future,TimeoutError
+except ImportError:
+  Future = None
+
+class ClientError(Exception):
+  pass
+
+class AuthFailure(ClientError):
+  pass
+
+# @param msg (bytes) a message body from the server
+# @return (str) msg as a native str
+def native(msg):
+
+  if str is bytes:
+    return msg
+  return msg.decode('utf8','replace')
+
+################################################################################
+# Future class
+################################################################################
+
+# python 2 only has concurrent.futures if the "futures" backport is installed
+if Future is None:
+
+  class TimeoutError(Exception):
+    pass
+
+  class Future(object):
+    """the parts of concurrent.futures.Future that SocketClient uses"""
+
+    def __init__(self):
+
+      self.__lock = threading.Lock()
+      self.__done = threading.Event()
+      self.__result = None
+      self.__exception = None
+      self.__callbacks = []
+
+    def done(self):
+
+      return self.__done.is_set()
+
+    # @param timeout (float) [None] seconds to wait (None = forever)
+    # @raise (TimeoutError) if the Future isn't done in time
+    def result(self,timeout=None):
+
+      if self.exception(timeout):
+        raise self.__exception
+      return self.__result
+
+    # @param timeout (float) [None] seconds to wait (None = forever)
+    # @raise (TimeoutError) if the Future isn't done in time
+    def exception(self,timeout=None):
+
+      if not self.__done.wait(timeout):
+        raise TimeoutError
+      return self.__exception
+
+    # @param func (callable) called with this Future once it's done
+    def add_done_callback(self,func):
+
+      with self.__lock:
+        if not self.__done.is_set():
+          self.__callbacks.append(func)
+          return
+      func(self)
+
+    # requests can't be taken back once they're sent, so this does nothing
+    def set_running_or_notify_cancel(self):
+
+      return True
+
+    def set_result(self,result):
+
+      self.__result = result
+      self.__finish()
+
+    def set_exception(self,exception):
+
+      self.__exception = exception
+      self.__finish()
+
+    def __finish(self):
+
+      with self.__lock:
+        self.__done.set()
+        (callbacks,self.__callbacks) = (self.__callbacks,[])
+      for func in callbacks:
+        func(self)
+
+################################################################################
+# SocketClient class
+################################################################################
+
+class SocketClient(object):
+
+  MSG_AUTH = '0'
+  MSG_TEXT = '1'
+  MSG_REQ = '2'
+  MSG_MORE = '3'
+  MSG_CAPS = '4'
+
+  AUTH_OKAY = 'OKAY'
+  AUTH_FAILED = 'FAILED'
+  AUTH_NONE = 'NONE'
+
+  # compress messages we send that are at least this big (if enabled)
+  COMPRESS = 1024
+
+  # @param host (str) ['localhost'] the host to connect to
+  # @param port (int) [8767] the port to connect to
+  # @param unix (str) [None] connect to this Unix socket instead of host:port
+  # @param password (str) [None] the bot's socket.password
+  # @param ssl (bool) [False] use SSL
+  # @param verify (bool) [True] verify the server's certificate
+  # @param cache (str) [None] file to save SSL sessions in so later connections
+  #   can resume them (see lib/tlscache.py)
+  # @param compress (bool) [False] ask the server to compress large messages
+  # @param timeout (float) [15] seconds to wait while connecting
+  def __init__(self,host='localhost',port=8767,unix=None,password=None,
+      ssl=False,verify=True,cache=None,compress=False,timeout=15):
+
+    self.host = host
+    self.port = port
+    self.unix = unix
+    self.password = password
+    self.ssl = (ssl and not unix)
+    self.verify = verify
+    self.cache = cache
+    self.compress = compress
+    self.timeout = timeout
+
+    # called with (text) for messages that aren't replies to a request
+    self.on_message = None
+    # called with (text) for status info e.g. "Authenticated"
+    self.on_log = None
+    # called with (ClientError) or None when the connection closes
+    self.on_close = None
+
+    self.lock = threading.Lock()
+    self.thread = None
+    self.sock = None
+    self.closing = False
+    self.sessions = None
+    self.session_key = None
+
+  def __enter__(self):
+
+    self.connect()
+    return self
+
+  def __exit__(self,typ,value,tb):
+
+    self.close()
+
+  # @return (bool) True if we have an open connection
+  def connected(self):
+
+    return self.thread is not None
+
+  # @raise (ClientError) if we can't connect
+  # @raise (AuthFailure) if the server rejected our password
+  def connect(self):
+    """connect and authenticate, unless we're already connected"""
+
+    with self.lock:
+      if self.thread:
+        return
+
+      self.decoder = Decoder()
+      self.encoder = Encoder()
+      self.pending = {}
+      self.parts = {}
+      self.ids = itertools.count(1)
+      self.auth_sent = False
+      self.closing = False
+
+      sock = self.__open()
+      try:
+        self.__hello(sock)
+      except socket.timeout:
+        sock.close()
+        raise ClientError('Timed out waiting for the server')
+      except socket.error as e:
+        sock.close()
+        raise ClientError('Socket error: %s' % (e.strerror or e))
+      except BaseException:
+        sock.close()
+        raise
+
+      sock.setblocking(0)
+      (self.wake_r,self.wake_w) = os.pipe()
+      for fd in (self.wake_r,self.wake_w):
+        fcntl.fcntl(fd,fcntl.F_SETFL,fcntl.fcntl(fd,fcntl.F_GETFL)|os.O_NONBLOCK)
+
+      self.sock = sock
+      self.thread = threading.Thread(target=self.__run)
+      self.thread.daemon = True
+      self.thread.start()
+
+  def close(self):
+    """send anything queued, then close the connection"""
+
+    with self.lock:
+      thread = self.thread
+      if thread:
+        self.closing = True
+        self.__wake()
+    if thread and thread is not threading.current_thread():
+      thread.join()
+
+  # @param cmd (str,unicode) the command to run
+  # @return (Future) resolves to the reply (str), or raises ClientError if the
+  #   connection closes first
+  # @raise (ClientError) if we weren't connected and can't reconnect
+  def submit(self,cmd):
+    """send a command as a tagged request, reconnecting if needed"""
+
+    self.connect()
+    future = Future()
+    future.set_running_or_notify_cancel()
+    with self.lock:
+      if not self.sock:
+        raise ClientError('Not connected')
+      request = str(next(self.ids))
+      self.pending[request] = future
+      self.encoder.put(request+' '+cmd,self.MSG_REQ)
+      self.__wake()
+    return future
+
+  # @param cmd (str,unicode) the command to run
+  # @param timeout (float) [None] seconds to wait for the reply (None = forever)
+  # @return (str) the reply
+  # @raise (TimeoutError) if the reply takes longer than timeout
+  # @raise (ClientError) if the connection closes first
+  def call(self,cmd,timeout=None):
+    """run a command and wait for its reply"""
+
+    return self.submit(cmd).result(timeout)
+
+  # @param text (str,unicode) the message to send
+  def send(self,text):
+    """send an untagged message; replies go to on_message"""
+
+    self.connect()
+    with self.lock:
+      if not self.sock:
+        raise ClientError('Not connected')
+      self.encoder.put(text,self.MSG_TEXT)
+      self.__wake()
+
+################################################################################
+
+  def __log(self,text):
+
+    if self.on_log:
+      self.on_log(text)
+
+  # @return (socket) a connected socket, after the SSL handshake if using SSL
+  def __open(self):
+
+    try:
+      if self.unix:
+        sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+          sock.connect(self.unix)
+        except BaseException:
+          sock.close()
+          raise
+      else:
+        sock = socket.create_connection((self.host,self.port),self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+    except socket.timeout:
+      raise ClientError('Timed out connecting')
+    except socket.error as e:
+      raise ClientError('Socket error: %s' % (e.strerror or e))
+
+    if self.ssl:
+      sock = self.__wrap(sock)
+    self.__log('Connected')
+    return sock
+
+  # @param sock (socket) a connected socket
+  # @return (SSLSocket) sock after the SSL handshake
+  def __wrap(self,sock):
+
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    if self.verify:
+      context.verify_mode = ssl.CERT_REQUIRED
+      context.check_hostname = True
+      context.load_default_certs()
+    context.options |= (ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3)
+    sock = context.wrap_socket(sock,server_hostname=self.host,
+        do_handshake_on_connect=False)
+
+    # don't let an unverified session skip verification later
+    if self.cache and not self.sessions:
+      self.sessions = SessionCache(self.cache)
+      if not self.sessions.enabled():
+        self.__log('Unable to save SSL sessions with this python')
+    if self.sessions and self.sessions.enabled():
+      verify = 'verify' if self.verify else 'noverify'
+      self.session_key = '%s:%s:%s' % (self.host,self.port,verify)
+      self.sessions.load(sock,self.session_key)
+
+    try:
+      sock.do_handshake()
+    except ssl.SSLEOFError:
+      sock.close()
+      raise ClientError('SSL handshake failed; does the server support it?')
+    except ssl.SSLError as e:
+      sock.close()
+      raise ClientError('SSL failed because: %s' % (e.reason or e))
+    except socket.timeout:
+      sock.close()
+      raise ClientError('Timed out during SSL handshake')
+    except socket.error as e:
+      sock.close()
+      raise ClientError('Socket error: %s' % (e.strerror or e))
+
+    if self.sessions and self.sessions.reused(sock):
+      self.__log('SSL Successful (resumed session)')
+    else:
+      self.__log('SSL Successful')
+    return sock
+
+  # @param sock (socket) a connected socket in blocking mode
+  def __hello(self,sock):
+    """send our password and caps, then wait until the server answers"""
+
+    waiting = set()
+    if self.password:
+      self.encoder.put(self.password,self.MSG_AUTH)
+      self.auth_sent = True
+      waiting.add(self.MSG_AUTH)
+    if self.compress:
+      self.encoder.put('zlib',self.MSG_CAPS)
+      waiting.add(self.MSG_CAPS)
+    self.encoder.send(sock)
+
+    while waiting:
+      if not self.decoder.recv_into(sock):
+        raise ClientError('Remote closed connection')
+      for (typ,msg) in self.decoder.frames():
+        self.__handle(typ,msg)
+        waiting.discard(typ)
+
+  def __wake(self):
+    """make the I/O thread check for new frames to send; needs self.lock"""
+
+    try:
+      os.write(self.wake_w,b'x')
+    except OSError as e:
+      if e.errno not in (errno.EAGAIN,errno.EWOULDBLOCK):
+        raise
+
+  def __run(self):
+    """the I/O thread"""
+
+    sock = self.sock
+    error = None
+    try:
+      while not self.closing:
+        writing = [sock] if self.encoder.pending() else []
+        (read,write,err) = select.select([sock,self.wake_r],writing,[])
+
+        if self.wake_r in read:
+          os.read(self.wake_r,4096)
+        if sock in read:
+          self.__read(sock)
+        with self.lock:
+          self.__flush(sock)
+    except ClientError as e:
+      error = e
+    except FrameError as e:
+      error = ClientError('Invalid data from server (%s)' % e)
+    except (socket.error,select.error,OSError) as e:
+      error = ClientError('Socket error: %s' % (getattr(e,'strerror',None) or e))
+
+    self.__cleanup(sock,error)
+
+  # @param sock (socket) the non-blocking socket to read from
+  def __read(self,sock):
+
+    while True:
+      try:
+        n = self.decoder.recv_into(sock)
+      except (ssl.SSLWantReadError,ssl.SSLWantWriteError):
+        break
+      except socket.error as e:
+        if e.errno in (errno.EAGAIN,errno.EWOULDBLOCK):
+          break
+        raise
+      if not n:
+        raise ClientError('Remote closed connection')
+
+      # SSL sockets can hold decrypted data that select() doesn't know about
+      if not (self.ssl and sock.pending()):
+        break
+
+    for (typ,msg) in self.decoder.frames():
+      self.__handle(typ,msg)
+
+  # @param sock (socket) the non-blocking socket to send on
+  def __flush(self,sock):
+
+    try:
+      self.encoder.send(sock)
+    except (ssl.SSLWantReadError,ssl.SSLWantWriteError):
+      pass
+    except socket.error as e:
+      if e.errno not in (errno.EAGAIN,errno.EWOULDBLOCK):
+        raise
+
+  # @param typ (str) the message type
+  # @param msg (bytes) the message body
+  def __handle(self,typ,msg):
+    """act on a single message from the server"""
+
+    if typ in (self.MSG_REQ,self.MSG_MORE):
+      (request,_,text) = msg.partition(b' ')
+      (request,text) = (request.decode('ascii'),native(text))
+      if typ==self.MSG_MORE:
+        self.parts.setdefault(request,[]).append(text)
+        return
+
+      # a stream that ends on a chunk boundary ends with an empty frame
+      parts = self.parts.pop(request,[])
+      if text or not parts:
+        parts.append(text)
+      with self.lock:
+        future = self.pending.pop(request,None)
+      if future:
+        future.set_result('\n'.join(parts))
+      elif self.on_message:
+        self.on_message('\n'.join(parts))
+
+    elif typ==self.MSG_TEXT:
+      if self.on_message:
+        self.on_message(native(msg))
+    elif typ==self.MSG_AUTH:
+      self.__check_auth(native(msg))
+    elif typ==self.MSG_CAPS:
+      self.__check_caps(native(msg))
+    else:
+      raise ClientError('Unsupported msg type "%s"' % typ)
+
+  def __check_auth(self,msg):
+
+    if not self.auth_sent:
+      raise AuthFailure('Server requires a password')
+
+    if msg==self.AUTH_OKAY:
+      self.__log('Authenticated')
+    elif msg==self.AUTH_FAILED:
+      raise AuthFailure('Invalid password')
+    elif msg==self.AUTH_NONE:
+      self.__log('Server does not require a password')
+    else:
+      raise ClientError('Received invalid Auth response from server')
+
+  def __check_caps(self,msg):
+
+    if 'zlib' in msg.split():
+      self.encoder.compress = self.COMPRESS
+      self.__log('Compression enabled')
+    else:
+      self.__log('Server does not support compression')
+
+  # @param sock (socket) the socket to close
+  # @param error (ClientError) why we're closing, or None if close() was called
+  def __cleanup(self,sock,error):
+    """close the socket and fail any requests still waiting for replies"""
+
+    with self.lock:
+      if not error:
+        try:
+          sock.settimeout(self.timeout)
+          self.encoder.send(sock)
+        except (socket.error,ValueError):
+          pass
+
+      # by now we've read the server's session ticket (if it sent one)
+      if self.sessions and self.session_key:
+        self.sessions.save(sock,self.session_key)
+
+      try:
+        sock.shutdown(socket.SHUT_RDWR)
+      except (socket.error,ValueError):
+        pass
+      sock.close()
+      os.close(self.wake_r)
+      os.close(self.wake_w)
+
+      (pending,self.pending) = (self.pending,{})
+      self.sock = None
+      self.thread = None
+
+    for future in pending.values():
+      future.set_exception(error or ClientError('Connection closed'))
+    if self.on_close:
+      self.on_close(error)
+    self.__log('Disconnected')
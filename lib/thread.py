@@ -20,7 +20,7 @@
 #
 ################################################################################
 
-import threading,traceback
+import sys,threading,traceback,time
 
 class SmartThread(threading.Thread):
   """smart threads log exceptions"""
@@ -67,3 +67,33 @@ class SmartThread(threading.Thread):
       self.bot.log_ex(e,
           'Error while executing threaded idle hook "%s":' % self.name)
       self.bot.del_hook(self.func,'idle')
+
+class ConnectThread(threading.Thread):
+  """connect threads connect a protocol and join its rooms off the main loop"""
+
+  def __init__(self,bot,proto,rooms):
+
+    super(ConnectThread,self).__init__()
+    self.daemon = True
+
+    self.bot = bot
+    self.proto = proto
+    self.rooms = rooms
+    self.name = 'connect.'+proto.get_name()
+    self.start_time = time.time()
+    self.exc_info = None
+
+  def run(self):
+
+    # hand connect() exceptions back to the main loop via exc_info
+    try:
+      self.proto.connect()
+    except Exception:
+      self.exc_info = sys.exc_info()
+      return
+
+    for room in self.rooms:
+      try:
+        self.proto.join_room(room)
+      except Exception as e:
+        self.bot.log_ex(e,'Error joining room "%s"' % room)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# TLS session resumption for the client.py/client3.py clients, so this file
+# must run on python 2 and 3. Resuming a session skips the certificate exchange
+# and the server's private key operation, which is most of what a handshake
+# costs a small server.
+#
+# The ssl module can't save a session to disk (python 2 can't even get one out
+# of a socket), so SessionCache calls OpenSSL through ctypes using the SSL
+# pointer inside the socket's _sslobj. Anything unexpected (not CPython, no
+# OpenSSL 1.1.1, a pointer that doesn't belong to the socket) turns the cache
+# off, and the client just does full handshakes like before.
+#
+# Saved sessions hold the secret needed to resume them, so the cache file is
+# only readable by its owner.
+#
+################################################################################
+
+import os,sys,json,base64,ctypes,platform,_ssl
+
+P = ctypes.c_void_p
+
+# functions we need from the libssl the ssl module is linked against
+FUNCS = {
+  'SSL_get1_session':(P,[P]),
+  'SSL_set_session':(ctypes.c_int,[P,P]),
+  'SSL_session_reused':(ctypes.c_int,[P]),
+  'SSL_get_fd':(ctypes.c_int,[P]),
+  'SSL_SESSION_free':(None,[P]),
+  'SSL_SESSION_is_resumable':(ctypes.c_int,[P]),
+  'i2d_SSL_SESSION':(ctypes.c_int,[P,ctypes.POINTER(P)]),
+  'd2i_SSL_SESSION':(P,[P,ctypes.POINTER(P),ctypes.c_long]),
+}
+
+# where the SSL pointer lives in _ssl._SSLSocket; python 2 keeps a socket
+# pointer and a weakref before it, python 3 only the weakref
+OFFSET = (object.__basicsize__
+    +ctypes.sizeof(P)*(2 if sys.version_info<(3,) else 1))
+
+# @return (CDLL) libssl with FUNCS set up, or None if we can't use it
+def load_lib():
+
+  if platform.python_implementation()!='CPython':
+    return None
+
+  # _ssl may be built into the interpreter instead of a shared library
+  try:
+    lib = ctypes.CDLL(getattr(_ssl,'__file__',None))
+    for (name,(res,args)) in FUNCS.items():
+      func = getattr(lib,name)
+      (func.restype,func.argtypes) = (res,args)
+  except (OSError,AttributeError):
+    return None
+  return lib
+
+################################################################################
+# SessionCache class
+################################################################################
+
+class SessionCache(object):
+
+  # @param path (str) the file to keep sessions in
+  def __init__(self,path):
+
+    self.path = os.path.expanduser(path)
+    self.lib = load_lib()
+    self.sessions = {}
+
+    try:
+      with open(self.path) as f:
+        sessions = json.load(f)
+      if isinstance(sessions,dict):
+        self.sessions = sessions
+    except (IOError,OSError,ValueError):
+      pass
+
+  # @return (bool) True if sessions can be saved and resumed
+  def enabled(self):
+
+    return self.lib is not None
+
+  # @param sock (SSLSocket) a connected socket that hasn't done its handshake
+  # @param key (str) what the session is for e.g. "host:port"
+  # @return (bool) True if a saved session will be offered to the server
+  def load(self,sock,key):
+    """offer the saved session for key in sock's next handshake"""
+
+    ptr = self.__ssl(sock)
+    if not ptr or key not in self.sessions:
+      return False
+
+    der = base64.b64decode(self.sessions[key])
+    buf = ctypes.create_string_buffer(der,len(der))
+    sess = self.lib.d2i_SSL_SESSION(None,ctypes.byref(P(ctypes.addressof(buf))),
+        len(der))
+    if not sess:
+      return False
+    try:
+      return self.lib.SSL_set_session(ptr,sess)==1
+    finally:
+      self.lib.SSL_SESSION_free(sess)
+
+  # @param sock (SSLSocket) a socket that has finished its handshake
+  # @param key (str) what the session is for e.g. "host:port"
+  # @return (bool) True if the session was saved
+  def save(self,sock,key):
+    """save sock's session to disk so the next client can resume it"""
+
+    ptr = self.__ssl(sock)
+    if not ptr:
+      return False
+
+    # TLS 1.3 sessions can't be resumed until we've read a ticket
+    sess = self.lib.SSL_get1_session(ptr)
+    if not sess:
+      return False
+    try:
+      if not self.lib.SSL_SESSION_is_resumable(sess):
+        return False
+      n = self.lib.i2d_SSL_SESSION(sess,None)
+      buf = ctypes.create_string_buffer(n)
+      self.lib.i2d_SSL_SESSION(sess,ctypes.byref(P(ctypes.addressof(buf))))
+    finally:
+      self.lib.SSL_SESSION_free(sess)
+
+    self.sessions[key] = base64.b64encode(buf.raw[:n]).decode('ascii')
+    return self.__write()
+
+  # @param sock (SSLSocket) a socket that has finished its handshake
+  # @return (bool) True if the handshake resumed a saved session
+  def reused(self,sock):
+
+    ptr = self.__ssl(sock)
+    return bool(ptr and self.lib.SSL_session_reused(ptr))
+
+  # @return (int) the SSL pointer for sock, or None if we can't find it
+  def __ssl(self,sock):
+
+    if not self.lib or getattr(sock,'_sslobj',None) is None:
+      return None
+    ptr = P.from_address(id(sock._sslobj)+OFFSET).value
+
+    # if this isn't sock's SSL object our offset is wrong for this python
+    if not ptr or self.lib.SSL_get_fd(ptr)!=sock.fileno():
+      self.lib = None
+      return None
+    return ptr
+
+  def __write(self):
+    """atomically replace the cache file, readable only by us"""
+
+    tmp = '%s.%s' % (self.path,os.getpid())
+    try:
+      fd = os.open(tmp,os.O_WRONLY|os.O_CREAT|os.O_TRUNC,0o600)
+      with os.fdopen(fd,'w') as f:
+        json.dump(self.sessions,f)
+      os.rename(tmp,self.path)
+    except (IOError,OSError):
+      try:
+        os.remove(tmp)
+      except OSError:
+        pass
+      return False
+    return True
@@ -143,17 +143,13 @@ class CLI(Protocol):
     if not self.event_data.is_set():
       return
 
+    # hand everything we've buffered to the bot; it rate-limits for us
+    self.event_data.clear()
     usr = Admin(self,USER)
-    text = self.queue.get()
-
-    if self.special_cmds(text):
-      return
-
-    msg = Message(usr,text)
-    self.bot._cb_message(msg)
-
-    if self.queue.empty():
-      self.event_data.clear()
+    while not self.queue.empty():
+      text = self.queue.get()
+      if not self.special_cmds(text):
+        self.push_msg(Message(usr,text))
 
     if self.bot._SibylBot__finished:
       self.event_close.set()
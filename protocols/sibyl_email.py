@@ -132,9 +132,9 @@ class MailProtocol(Protocol):
     self._connect_smtp()
     self.log.info('SMTP successful')
 
-  # receive/process messages and call bot._cb_message()
+  # receive/process messages and queue them with self.push_msg()
   # must ignore msgs from myself and from users not in any of our rooms
-  # @call bot._cb_message(Message) upon receiving a valid status or message
+  # @call self.push_msg(Message) upon receiving a valid status or message
   # @raise (PingTimeout) if implemented
   # @raise (ConnectFailure) if disconnected
   # @raise (ServerShutdown) if server shutdown
@@ -177,7 +177,7 @@ class MailProtocol(Protocol):
       self.log.debug('mail from "%s" with body "%.20s%s"' % (user,body,ellip))
 
       # pass the message on to the bot for command execution
-      self.bot._cb_message(msg)
+      self.push_msg(msg)
 
   # called when the bot is exiting for whatever reason
   # NOTE: sibylbot will already call part_room() on every room in get_rooms()
@@ -200,9 +200,9 @@ class MatrixProtocol(Protocol):
   def _matrix_exception_handler(self, e):
     self.msg_queue.put(e)
 
-  # receive/process messages and call bot._cb_message()
+  # receive/process messages and queue them with self.push_msg()
   # must ignore msgs from myself and from users not in any of our rooms
-  # @call bot._cb_message(Message) upon receiving a valid status or message
+  # @call self.push_msg(Message) upon receiving a valid status or message
   # @raise (PingTimeout) if implemented
   # @raise (ConnectFailure) if disconnected
   # @raise (ServerShutdown) if server shutdown
@@ -211,7 +211,7 @@ class MatrixProtocol(Protocol):
       next = self.msg_queue.get()
       if(isinstance(next, Message)):
         self.log.debug("Placing message into queue: " + next.get_text())
-        self.bot._cb_message(next)
+        self.push_msg(next)
       elif(isinstance(next, MatrixHttpLibError)):
         self.log.debug("Received error from Matrix SDK, stopping listener thread: " + str(next))
         self.client.stop_listener_thread()
@@ -20,11 +20,13 @@
 #
 ################################################################################
 
-import socket,select,errno,time,traceback
+import sys,os,socket,select,errno,fcntl,ssl,stat,struct,pwd
 from threading import Thread,Event
 from Queue import Queue
+from collections import deque
 
-from sibyl.lib.protocol import User,Room,Message,Protocol
+from sibyl.lib.protocol import User,Room,Message,Protocol,to_unicode
+from sibyl.lib.codec import Decoder,Encoder,FrameError,encode,JOIN_SIZE
 
 from sibyl.lib.decorators import botconf
 
@@ -35,23 +37,98 @@ from sibyl.lib.decorators import botconf
 @botconf
 def conf(bot):
   return [
-    {'name':'port','default':8767},
+    {'name':'port','default':8767,'parse':bot.conf.parse_int},
     {'name':'password'},
     {'name':'pubkey','valid':bot.conf.valid_rfile},
     {'name':'privkey','valid':bot.conf.valid_rfile},
     {'name':'key_password'},
     {'name':'internet','default':False,'parse':bot.conf.parse_bool},
+    {'name':'stream_window','default':65536,'parse':bot.conf.parse_int,
+        'valid':bot.conf.valid_nump},
+    {'name':'compress','default':1024,'parse':bot.conf.parse_int},
+    {'name':'unix'},
+    {'name':'unix_users','default':[],'parse':parse_users},
     {'name':'debug','default':False,'parse':bot.conf.parse_bool}
   ]
 
+# @return (list of int) uids of the given comma-separated user names or uids
+def parse_users(conf,opt,val):
+
+  uids = []
+  for user in val.replace(' ','').split(','):
+    if not user:
+      continue
+    if user.isdigit():
+      uids.append(int(user))
+    else:
+      try:
+        uids.append(pwd.getpwnam(user).pw_uid)
+      except KeyError:
+        conf.log('warning','Unknown user "%s" in %s' % (user,opt))
+  return uids
+
+# python 2 doesn't define this, but Linux has had it forever
+SO_PEERCRED = getattr(socket,'SO_PEERCRED',
+    17 if sys.platform.startswith('linux') else None)
+
+# @param conn (socket) a connected Unix domain socket
+# @return (int) the uid of the process on the other end, or None if unknown
+def peer_uid(conn):
+
+  if SO_PEERCRED is None:
+    return None
+  creds = conn.getsockopt(socket.SOL_SOCKET,SO_PEERCRED,struct.calcsize('3i'))
+  return struct.unpack('3i',creds)[1]
+
+################################################################################
+# Poller class
+################################################################################
+
+class Poller(object):
+  """wrap epoll (Linux) or poll (everywhere else) behind the same interface"""
+
+  READ = select.POLLIN
+  WRITE = select.POLLOUT
+  ERROR = select.POLLERR|select.POLLHUP
+
+  def __init__(self):
+
+    self.epoll = hasattr(select,'epoll')
+    self.poller = (select.epoll() if self.epoll else select.poll())
+
+  def register(self,fd,mask):
+    self.poller.register(fd,mask)
+
+  def modify(self,fd,mask):
+    self.poller.modify(fd,mask)
+
+  def unregister(self,fd):
+    self.poller.unregister(fd)
+
+  # @param timeout (float) [None] seconds to wait, or None to wait forever
+  # @return (list of tuple) (fd,event_mask) pairs that are ready
+  def poll(self,timeout=None):
+
+    if self.epoll:
+      timeout = (-1 if timeout is None else timeout)
+    elif timeout is not None:
+      timeout = int(timeout*1000)
+
+    try:
+      return self.poller.poll(timeout)
+    except (IOError,select.error) as e:
+      if e.args[0]==errno.EINTR:
+        return []
+      raise
+
 ################################################################################
 # ServerThread class
 ################################################################################
 
 class ServerThread(Thread):
 
-  def __init__(self,log,q,d,c,pword=None,debug=False,ssl=None):
-    """create a new thread that handles socket connections"""
+  def __init__(self,log,q,d,c,pword=None,debug=False,ssl=None,compress=0):
+    """create a new thread that handles every socket connection"""
 
     super(ServerThread,self).__init__()
     self.daemon = True
@@ -63,193 +140,468 @@ class ServerThread(Thread):
     self.password = pword
     self.debug = debug
     self.context = ssl
+    self.compress = compress
 
-    self.dead = Queue()
     self.clients = {}
+    self.fds = {}
+    self.outgoing = deque()
+    self.poller = Poller()
+
+    # called (from this thread) when a client's backlog drops below the
+    # level passed to want_drain(); SocketServer uses it to resume streams
+    self.on_drain = None
+
+    # called (from this thread) after queueing a received message
+    self.on_data = None
+
     self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
     self.socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
 
+    # optional Unix domain socket for local clients (see bind_unix)
+    self.unix = None
+    self.unix_path = None
+    self.unix_uids = None
+    self.unix_count = 0
+
+    # writing to this pipe wakes the thread up when there's something to send
+    (self.wake_r,self.wake_w) = os.pipe()
+    for fd in (self.wake_r,self.wake_w):
+      flags = fcntl.fcntl(fd,fcntl.F_GETFL)
+      fcntl.fcntl(fd,fcntl.F_SETFL,flags|os.O_NONBLOCK)
+
   def bind(self,hostname,port):
     """bind our server socket"""
 
     self.socket.bind((hostname,port))
-    self.socket.listen(5)
+    self.socket.listen(socket.SOMAXCONN)
+    self.socket.setblocking(0)
+
+  # local clients that connect here skip TLS and the password; the socket file
+  # is only accessible to our user unless others are allowed, in which case we
+  # check each client's uid instead (Linux only)
+  # @param path (str) file name for the socket
+  # @param uids (list of int) [None] extra uids to allow besides ours and root
+  def bind_unix(self,path,uids=None):
+    """bind a Unix domain socket in addition to the TCP one"""
+
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+      os.unlink(path)
+
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    mask = os.umask(0o177)
+    try:
+      sock.bind(path)
+    finally:
+      os.umask(mask)
+    if uids:
+      if SO_PEERCRED is None:
+        self.log.warning('Unable to check uids on this OS; using only file '
+            'permissions for "%s"' % path)
+      else:
+        os.chmod(path,0o666)
+    sock.listen(socket.SOMAXCONN)
+    sock.setblocking(0)
 
-  def run(self):
-    """accept incoming connections and spawn clients"""
+    self.unix = sock
+    self.unix_path = path
+    self.unix_uids = set([os.getuid(),0]+(uids or []))
 
+  def run(self):
+    """accept connections and move data for every client in one loop"""
+
+    self.poller.register(self.socket.fileno(),Poller.READ)
+    self.poller.register(self.wake_r,Poller.READ)
+    if self.unix:
+      self.poller.register(self.unix.fileno(),Poller.READ)
+
+    while not self.event_close.is_set():
+
+      for (fd,event) in self.poller.poll():
+        if fd==self.socket.fileno():
+          self.accept(self.socket)
+        elif self.unix and fd==self.unix.fileno():
+          self.accept(self.unix)
+        elif fd==self.wake_r:
+          self.drain_wake()
+        elif fd in self.fds:
+          conn = self.fds[fd]
+          if event & (Poller.READ|Poller.ERROR):
+            conn.handle_read()
+          if event & Poller.WRITE and fd in self.fds:
+            conn.handle_write()
+
+      while self.outgoing:
+        (address,data) = self.outgoing.popleft()
+        if address in self.clients:
+          conn = self.clients[address]
+          conn.moved += sum([len(b) for b in data])
+          conn.write(data)
+
+    for conn in self.clients.values():
+      conn.close()
+    self.socket.close()
+    if self.unix:
+      self.unix.close()
+      try:
+        os.unlink(self.unix_path)
+      except OSError:
+        pass
+    os.close(self.wake_r)
+    os.close(self.wake_w)
+
+  # @param listener (socket) the listening socket with pending connections
+  def accept(self,listener):
+    """accept every pending connection without blocking"""
+
+    local = (listener is self.unix)
     while True:
-
-      if self.event_close.is_set():
-        break
-      (read,write,err) = select.select([self.socket],[],[],1)
-
-      if self.socket in read:
-        (conn,address) = self.socket.accept()
-
-        try:
+      try:
+        (conn,address) = listener.accept()
+      except socket.error as e:
+        if e.errno not in (errno.EAGAIN,errno.EWOULDBLOCK):
+          self.log.warning('Error accepting connection (%s)' % e)
+        return
+
+      # Unix sockets don't have a useful address, so number them instead
+      if local:
+        self.unix_count += 1
+        address = ('unix',self.unix_count)
+
+      try:
+        conn.setblocking(0)
+        if local:
+          uid = peer_uid(conn)
+          if uid is not None and uid not in self.unix_uids:
+            self.log.warning('Refused connection %s:%s from uid %s' %
+                (address+(uid,)))
+            conn.close()
+            continue
+
+        # we buffer for ourselves, so Nagle only delays split header/body sends
+        else:
+          conn.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
           if self.context:
-            conn = self.context.wrap_socket(conn,server_side=True)
-          self.log.info('Got new connection from %s:%s' % address)
-          q = Queue()
-          self.clients[address] = q
-          ipc = {'rq':self.queue,'sq':q,
-                  'ed':self.event_data,'ec':self.event_close}
-          ClientThread(self,conn,address,ipc).start()
-        except Exception as e:
-          self.log.warning('New connection %s:%s failed (%s)' %
-              (address+(e.__class__.__name__,)))
-          try:
-            conn.shutdown(socket.SHUT_RDWR)
-          except:
-            pass
-          conn.close()
+            conn = self.context.wrap_socket(conn,server_side=True,
+                do_handshake_on_connect=False)
+      except Exception as e:
+        self.log.warning('New connection %s:%s failed (%s)' %
+            (address+(e.__class__.__name__,)))
+        conn.close()
+        continue
+
+      self.log.info('Got new connection from %s:%s' % address)
+      client = Connection(self,conn,address,local)
+      self.clients[address] = client
+      self.fds[client.fd] = client
+      self.poller.register(client.fd,Poller.READ)
+      if client.handshake:
+        client.do_handshake()
+
+  def wake(self):
+    """interrupt poll() from another thread"""
 
-      while not self.dead.empty():
-        client = self.dead.get()
-        del self.clients[client]
-        self.log.info('Connection closed %s:%s@socket' % client)
-
-      time.sleep(0.1)
-
-    self.socket.close()
+    try:
+      os.write(self.wake_w,'x')
+    except OSError as e:
+      if e.errno!=errno.EAGAIN:
+        raise
 
-  def send(self,text,address):
-    """queue a message to be sent"""
+  def drain_wake(self):
+    """empty the wake-up pipe"""
 
     try:
-      self.clients[address].put(text)
-    except KeyError:
+      while os.read(self.wake_r,4096):
+        pass
+    except OSError as e:
+      if e.errno!=errno.EAGAIN:
+        raise
+
+  def stop(self):
+    """tell the thread to close every connection and exit"""
+
+    self.event_close.set()
+    self.wake()
+
+  # @param address (tuple) the client's address
+  # @param text (str) the received message
+  # @param request (str) [None] the request ID the message was sent with
+  def push(self,address,text,request=None):
+    """hand a received message to the bot"""
+
+    self.queue.put((address,text,request))
+    self.event_data.set()
+    if self.on_data:
+      self.on_data()
+
+  # @param text (str,unicode) the message to send
+  # @param address (tuple) the client's address
+  # @param request (str) [None] the request ID this message is a reply to
+  # @param more (bool) [False] this is part of a streamed reply with more to come
+  def send(self,text,address,request=None,more=False):
+    """queue a message to be sent (this function is thread-safe)"""
+
+    conn = self.clients.get(address)
+    if conn is None:
       self.log.warning('Attempted to send a message to a disconnected client')
+      return
+
+    if request is None:
+      data = encode(text,Connection.MSG_TEXT,conn.compress)
+    else:
+      typ = Connection.MSG_MORE if more else Connection.MSG_REQ
+      data = encode(request+' '+text,typ,conn.compress)
+    conn.queued += sum([len(b) for b in data])
+    self.outgoing.append((address,data))
+    self.wake()
+
+  # @param address (tuple) the client's address
+  # @return (int,None) bytes queued for the client but not yet sent, or None if
+  #   the client has disconnected
+  def backlog(self,address):
+
+    conn = self.clients.get(address)
+    if conn is None:
+      return None
+    return conn.queued-conn.moved+conn.encoder.size
+
+  # @param address (tuple) the client's address
+  # @param level (int) call self.on_drain() once the backlog is at most this
+  def want_drain(self,address,level):
+
+    conn = self.clients.get(address)
+    if conn is not None:
+      conn.drain = level
 
 ################################################################################
-# ClientThread class
+# Connection class
 ################################################################################
 
-class ClientThread(Thread):
+class Connection(object):
 
   MSG_AUTH = '0'
   MSG_TEXT = '1'
+  MSG_REQ = '2'
+  MSG_MORE = '3'
+  MSG_CAPS = '4'
+
+  # request IDs are chosen by the client; keep them short and printable
+  REQ_MAX = 64
 
   AUTH_OKAY = 'OKAY'
   AUTH_FAILED = 'FAILED'
   AUTH_NONE = 'NONE'
 
-  def __init__(self,srv,conn,addr,ipc):
-
-    """cretae a new thread that handles client connections"""
-
-    super(ClientThread,self).__init__()
-    self.daemon = True
-    self.authed = (srv.password is None)
+  # @param local (bool) [False] True for Unix socket clients (no TLS/password)
+  def __init__(self,srv,conn,addr,local=False):
+    """buffer and parse data for one client; only used by ServerThread"""
 
     self.server = srv
     self.socket = conn
     self.address = addr
-    self.ipc = ipc
+    self.fd = conn.fileno()
 
     self.log = srv.log
-    self.buffer = ''
+    self.authed = (srv.password is None or local)
+    self.tls = (srv.context is not None and not local)
+    self.handshake = self.tls
+    self.closing = False
+    self.writing = False
 
-  def run(self):
-    """receive and send data on the socket"""
+    # compress replies at least this big; set if the client asks for "zlib"
+    self.compress = 0
 
-    while not self.ipc['ec'].is_set():
-      (read,write,err) = select.select([self.socket],[self.socket],[],1)
+    # bytes handed to ServerThread.send() and bytes moved into our encoder
+    self.queued = 0
+    self.moved = 0
+    self.drain = None
 
-      if self.socket in read:
-        try:
-          msgs = self.get_msgs()
-        except:
+    self.decoder = Decoder()
+    self.encoder = Encoder()
+
+  def do_handshake(self):
+    """advance a non-blocking TLS handshake"""
+
+    try:
+      self.socket.do_handshake()
+    except ssl.SSLWantReadError:
+      return self.set_writing(False)
+    except ssl.SSLWantWriteError:
+      return self.set_writing(True)
+    except Exception as e:
+      self.log.warning('New connection %s:%s failed (%s)' %
+          (self.address+(e.__class__.__name__,)))
+      return self.close()
+
+    self.handshake = False
+    self.set_writing(bool(self.encoder.pending()))
+    self.handle_read()
+
+  def handle_read(self):
+    """read whatever is available and act on complete messages"""
+
+    if self.handshake:
+      return self.do_handshake()
+
+    try:
+      while True:
+        n = self.decoder.recv_into(self.socket)
+        if self.server.debug:
+          self.log.debug('recv %s bytes' % n)
+        if not n:
+          self.log.debug('Received EOS from %s:%s' % self.address)
+          return self.close()
+
+        # SSL sockets can hold decrypted data that poll() doesn't know about
+        if not (self.tls and self.socket.pending()):
           break
-        if msgs:
-          self.ipc['ed'].set()
-        for msg in msgs:
-          if msg:
-            self.ipc['rq'].put((self.address,msg))
+    except (ssl.SSLWantReadError,ssl.SSLWantWriteError):
+      pass
+    except socket.error as e:
+      if e.errno not in (errno.EAGAIN,errno.EWOULDBLOCK):
+        return self.close()
 
-      if self.socket in write:
-        while not self.ipc['sq'].empty():
-          self.send_msg(self.ipc['sq'].get())
+    self.parse()
 
-      time.sleep(0.1)
+  def handle_write(self):
+    """send as much buffered data as the socket will take"""
 
-    self.server.dead.put(self.address)
-    self.socket.close()
+    if self.handshake:
+      return self.do_handshake()
+    self.flush()
 
-  def get_msgs(self):
-
-    msgs = []
-    while self.buffer or not msgs:
-      (typ,msg) = self.get_msg()
-      if self.server.debug:
-        self.log.debug('act typ=%s "%s"' % (typ,msg))
-      if typ==ClientThread.MSG_AUTH:
-        self.do_auth(msg)
-        msg = None
-      elif typ==ClientThread.MSG_TEXT or typ is None:
-        if not self.authed:
-          self.log.warning('Remote %s:%s did not attempt Auth' % self.address)
-          self.send_msg(ClientThread.AUTH_FAILED,ClientThread.MSG_AUTH)
-          raise RuntimeError
-        msgs.append(msg)
-      else:
-        self.log.error('Unsupported msg type "%s"' % typ)
-        self.send_msg('Unsupported msg type "%s"; closing connection' % typ)
-        raise RuntimeError
+  def parse(self):
+    """act on every complete message in the receive buffer"""
 
-    return msgs
+    try:
+      for (typ,msg) in self.decoder.frames():
+        self.handle_msg(typ,msg)
+        if self.closing:
+          return
+    except FrameError as e:
+      self.log.warning('%s from %s:%s' % ((e.message,)+self.address))
+      self.close()
 
-  def get_msg(self):
+  def handle_msg(self,typ,msg):
+    """act on a single message from the client"""
 
-    msg = self.buffer
-    while ' ' not in msg:
-      s = self.socket.recv(4096)
-      if self.server.debug:
-        self.log.debug('recv "%s"' % s)
-      if not s:
-        self.log.debug('Received EOS from %s:%s' % self.address)
-        raise RuntimeError
-      msg += s
+    if self.server.debug:
+      self.log.debug('act typ=%s "%s"' % (typ,msg))
+
+    if typ==Connection.MSG_AUTH:
+      self.do_auth(msg)
+    elif typ in (Connection.MSG_TEXT,Connection.MSG_REQ,Connection.MSG_CAPS):
+      if not self.authed:
+        self.log.warning('Remote %s:%s did not attempt Auth' % self.address)
+        self.write(encode(Connection.AUTH_FAILED,Connection.MSG_AUTH))
+        self.closing = True
+      elif typ==Connection.MSG_REQ:
+        self.handle_req(msg)
+      elif typ==Connection.MSG_CAPS:
+        self.handle_caps(msg)
+      elif msg:
+        self.server.push(self.address,msg)
+    else:
+      self.log.error('Unsupported msg type "%s"' % typ)
+      self.write(encode('Unsupported msg type "%s"; closing connection' % typ,
+          Connection.MSG_TEXT))
+      self.closing = True
+
+    if self.closing and not self.encoder.pending():
+      self.close()
+
+  def handle_req(self,msg):
+    """queue a message that carries a request ID for the bot's replies"""
+
+    (request,_,text) = msg.partition(' ')
+    if (not request or len(request)>Connection.REQ_MAX
+        or not all(33<=ord(c)<127 for c in request)):
+      self.log.warning('Invalid request ID from %s:%s' % self.address)
+      self.write(encode('Invalid request ID',Connection.MSG_TEXT))
+      return
+
+    if text:
+      self.server.push(self.address,text,request)
 
-    length_str = msg.split(' ')[0]
-    target = len(length_str)+1+int(length_str)
-    while len(msg)<target:
-      msg += self.socket.recv(min(target-len(msg),4096))
+  def handle_caps(self,msg):
+    """reply with the requested capabilities that we support, and enable them"""
 
-    (msg,self.buffer) = (msg[:target],msg[target:])
-    msg = msg[msg.find(' ')+1:]
-    return (msg[0],msg[2:])
+    caps = []
+    for cap in msg.split():
+      if cap=='zlib' and self.server.compress>0:
+        self.compress = self.server.compress
+        caps.append(cap)
+
+    self.log.debug('Enabled caps %s for %s:%s' % ((caps,)+self.address))
+    self.write(encode(' '.join(caps),Connection.MSG_CAPS))
 
   def do_auth(self,msg):
 
     if self.authed:
-      self.send_msg(ClientThread.AUTH_NONE,ClientThread.MSG_AUTH)
+      self.write(encode(Connection.AUTH_NONE,Connection.MSG_AUTH))
       return
 
     if self.server.password==msg:
       self.authed = True
-      self.send_msg(ClientThread.AUTH_OKAY,ClientThread.MSG_AUTH)
+      self.write(encode(Connection.AUTH_OKAY,Connection.MSG_AUTH))
       self.log.debug('Successful auth from %s:%s' % self.address)
     else:
-      self.send_msg(ClientThread.AUTH_FAILED,ClientThread.MSG_AUTH)
+      self.write(encode(Connection.AUTH_FAILED,Connection.MSG_AUTH))
       self.log.warning('Invalid password from %s:%s' % self.address)
-      raise RuntimeError
-
-  def send_msg(self,msg,typ=None):
+      self.closing = True
 
-    typ = typ or ClientThread.MSG_TEXT
-    msg = typ+' '+msg
-    length_str = str(len(msg))
-    msg = (length_str+' '+msg)
-    target = len(msg)
+  # @param bufs (tuple of str) an encoded message from encode()
+  def write(self,bufs):
+    """buffer data and try to send it right away"""
 
     if self.server.debug:
-      self.log.debug('send "%s"' % msg)
+      self.log.debug('send "%s"' % ''.join(bufs))
 
-    sent = 0
-    while sent<target:
-      sent += self.socket.send(msg[sent:])
+    self.encoder.extend(bufs)
+    if not self.handshake:
+      self.flush()
+
+  def flush(self):
+
+    try:
+      self.encoder.send(self.socket)
+    except (ssl.SSLWantReadError,ssl.SSLWantWriteError):
+      pass
+    except socket.error as e:
+      if e.errno not in (errno.EAGAIN,errno.EWOULDBLOCK):
+        return self.close()
+
+    if self.closing and not self.encoder.size:
+      return self.close()
+    if bool(self.encoder.size)!=self.writing:
+      self.set_writing(not self.writing)
+
+    if (self.drain is not None and self.server.on_drain and
+        self.encoder.size<=self.drain):
+      self.drain = None
+      self.server.on_drain()
+
+  def set_writing(self,writing):
+    """only ask poll() about writability while we have data to send"""
+
+    if writing!=self.writing and self.fd in self.server.fds:
+      self.writing = writing
+      mask = Poller.READ|(Poller.WRITE if writing else 0)
+      self.server.poller.modify(self.fd,mask)
+
+  def close(self):
+
+    if self.fd not in self.server.fds:
+      return
+
+    self.server.poller.unregister(self.fd)
+    del self.server.fds[self.fd]
+    del self.server.clients[self.address]
+    try:
+      self.socket.shutdown(socket.SHUT_RDWR)
+    except:
+      pass
+    self.socket.close()
+    self.log.info('Connection closed %s:%s@socket' % self.address)
 
 ################################################################################
 # User sub-class
@@ -257,9 +609,12 @@ class ClientThread(Thread):
 
 class Client(User):
 
+  # @param info (tuple) the client's address
+  # replies to this User are tagged with self.request if it isn't None
   def parse(self,info):
     self.address = info
     self.user = '%s:%s@socket' % info
+    self.request = None
 
   def get_name(self):
     return self.user
@@ -304,9 +659,14 @@ class SocketServer(Protocol):
   def setup(self):
 
     self.thread = None
+    self.streams = deque()
+
+    # kept across reconnects so clients can still resume their SSL sessions
+    self.context = None
 
   def connect(self):
 
+    self.streams.clear()
     q = Queue()
     if hasattr(self,'queue'):
       for x in self.queue.queue:
@@ -321,14 +681,13 @@ class SocketServer(Protocol):
     port = self.opt('socket.port')
     pword = self.opt('socket.key_password')
 
-    context = None
+    context = self.context
     (key,crt) = (self.opt('socket.privkey'),self.opt('socket.pubkey'))
-    if key or crt:
+    if context is None and (key or crt):
       if not (key and crt):
         missing = [x for (x,y) in {'pubkey':crt,'privkey':key}.items() if not y]
         self.log.error('Missing %s; not using SSL' % missing[0])
       else:
-        import ssl
         context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
         context.verify_mode = ssl.CERT_NONE
         try:
@@ -337,10 +696,14 @@ class SocketServer(Protocol):
           self.log.debug('Error loading cert chain (%s)' % e.__class__.__name__)
           self.log.error('Invalid privkey password; not using SSL')
           context = None
+    self.context = context
 
     self.thread = ServerThread(self.log,
         self.queue,self.event_data,self.event_close,
-        self.opt('socket.password'),self.opt('socket.debug'),context)
+        self.opt('socket.password'),self.opt('socket.debug'),context,
+        self.opt('socket.compress'))
+    self.thread.on_drain = self.bot.wake
+    self.thread.on_data = self.bot.wake
 
     self.log.info('Attempting to bind to %s:%s' % (hostname,port))
     try:
@@ -354,34 +717,47 @@ class SocketServer(Protocol):
         self.log.error('Unhandled error %s = %s' % (n,errno.errorcode[n]))
         raise self.AuthFailure
 
+    path = self.opt('socket.unix')
+    if path:
+      self.log.info('Attempting to bind to "%s"' % path)
+      try:
+        self.thread.bind_unix(path,self.opt('socket.unix_users'))
+      except Exception as e:
+        self.log.error('Unable to bind to "%s" (%s)' % (path,e))
+
     self.thread.start()
 
   def process(self):
 
-    if not self.event_data.is_set():
-      return
-
-    (address,text) = self.queue.get()
-    usr = Client(self,address)
-
-    if self.special_cmds(text):
-      return
-
-    msg = Message(usr,text)
-    self.bot._cb_message(msg)
-
-    if self.queue.empty():
+    # hand everything we've buffered to the bot; it rate-limits for us
+    if self.event_data.is_set():
       self.event_data.clear()
+      while not self.queue.empty():
+        (address,text,request) = self.queue.get()
+        if not self.special_cmds(text):
+          user = Client(self,address)
+          user.request = request
+          self.push_msg(Message(user,text))
+
+    return self.pump()
 
   def shutdown(self):
-    if hasattr(self,'event_close'):
-      self.event_close.set()
-    if self.thread:
+    if self.thread and self.thread.is_alive():
+      self.thread.stop()
       self.thread.join()
 
   def send(self,mess):
     (text,to) = (mess.get_text(),mess.get_to())
-    self.thread.send(text,to.address)
+
+    # don't let a message jump ahead of a streamed reply that's still going
+    if [s for s in self.streams if s[0].address==to.address]:
+      self.streams.append((to,iter([text])))
+    else:
+      self.thread.send(text,to.address,to.request)
+
+  def send_stream(self,mess):
+    self.streams.append((mess.get_to(),mess.get_stream()))
+    self.pump()
 
   def broadcast(self,mess):
     pass
@@ -420,6 +796,58 @@ class SocketServer(Protocol):
 
     return self.opt('socket.key_password') or ''
 
+  def pump(self):
+    """send more of each streamed reply while its client keeps up"""
+
+    # replies to tagged requests are sent as MSG_MORE frames ending with a
+    # MSG_REQ frame; replies to old-style messages are just MSG_TEXT frames
+    window = self.opt('socket.stream_window')
+    busy = False
+    started = set()
+    for stream in list(self.streams):
+      (to,lines) = stream
+
+      # each client gets its streams one at a time, in order
+      if to.address in started:
+        continue
+      room = self.thread.backlog(to.address)
+      if room is None:
+        self.streams.remove(stream)
+        continue
+      room = window-room
+
+      # if the client is behind, wait until it's read half of what it has
+      if room<=0:
+        self.thread.want_drain(to.address,window/2)
+        started.add(to.address)
+        continue
+
+      done = False
+      while room>0 and not done:
+        (chunk,size) = ([],0)
+        while size<min(room,JOIN_SIZE):
+          try:
+            line = to_unicode(next(lines))
+          except StopIteration:
+            done = True
+            break
+          chunk.append(line)
+          size += len(line)+1
+
+        text = '\n'.join(chunk)
+        if not done:
+          self.thread.send(text,to.address,to.request,more=True)
+        elif chunk or to.request is not None:
+          self.thread.send(text,to.address,to.request)
+        room -= size
+        busy = True
+
+      if done:
+        self.streams.remove(stream)
+      else:
+        started.add(to.address)
+    return busy
+
   def special_cmds(self,text):
     """process special admin commands"""
 
@@ -490,7 +490,7 @@ class XMPP(Protocol):
       text = text[3:].strip()
       emote = True
 
-    self.bot._cb_message(Message(user,text,typ=typ,room=room,emote=emote))
+    self.push_msg(Message(user,text,typ=typ,room=room,emote=emote))
 
   def callback_presence(self,conn,pres):
     """run upon receiving a presence stanza to keep track of subscriptions"""
@@ -629,9 +629,9 @@ class XMPP(Protocol):
     if real:
       frm.set_real(real)
 
-    # call SibylBot's message callback
+    # queue the message for SibylBot's message callback
     msg = Message(frm,None,typ=typ,status=status,msg=status_msg,room=room)
-    self.bot._cb_message(msg)
+    self.push_msg(msg)
 
 ################################################################################
 # Helper functions
@@ -108,9 +108,10 @@ class MYPROTOCOL(Protocol):
   def is_connected(self):
     raise NotImplementedError
 
-  # receive/process messages and call bot._cb_message()
+  # receive/process messages and queue them with self.push_msg()
   # must ignore msgs from myself and from users not in any of our rooms
-  # @call bot._cb_message(Message) upon receiving a valid status or message
+  # @call self.push_msg(Message) upon receiving a valid status or message
+  # @return (bool) [optional] True if there's more work to do right away
   # @raise (PingTimeout) if implemented
   # @raise (ConnectFailure) if disconnected
   # @raise (ServerShutdown) if server shutdown
@@ -128,6 +129,12 @@ class MYPROTOCOL(Protocol):
   def send(self,mess):
     raise NotImplementedError
 
+  # [optional] send a reply whose lines come from mess.get_stream()
+  # the default in Protocol calls mess.join_stream() and then self.send()
+  # @param mess (Message) message to be sent
+  #def send_stream(self,mess):
+  #  raise NotImplementedError
+
   # send a message with text to every user in a room
   # optionally note that the broadcast was requested by a specific User
   # @param mess (Message) the message to broadcast
@@ -0,0 +1,90 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# Measures lib/socketclient.py against the socket protocol's ServerThread. An
+# echo thread stands in for the bot. One SocketClient sends N commands with
+# call() (one at a time) and then with submit() (all in flight at once), over
+# one connection each time, and prints the commands per second. Usage:
+#
+#   python2 bench_client.py [-n COUNT] [-s SIZE] [-p PORT]
+#
+# The bot is imported as "sibyl", so the repo's parent dir must be importable.
+#
+################################################################################
+
+import sys,os,time,argparse,logging,threading
+from Queue import Queue
+from threading import Event
+
+sys.path.insert(0,os.path.abspath(os.path.join(os.path.dirname(__file__),
+    '..','..')))
+
+from sibyl.protocols.sibyl_socket import ServerThread
+from sibyl.lib.socketclient import SocketClient
+
+def echo(srv):
+
+  while True:
+    (address,msg,request) = srv.queue.get()
+    srv.send(msg,address,request)
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-n',type=int,default=2000,help='commands per mode')
+  parser.add_argument('-s',type=int,default=32,help='command size in bytes')
+  parser.add_argument('-p',type=int,default=18772,help='port to listen on')
+  args = parser.parse_args()
+
+  log = logging.getLogger('socket')
+  log.addHandler(logging.NullHandler())
+  log.propagate = False
+
+  srv = ServerThread(log,Queue(),Event(),Event())
+  srv.bind('localhost',args.p)
+  srv.start()
+  t = threading.Thread(target=echo,args=(srv,))
+  t.daemon = True
+  t.start()
+
+  cmds = ['%08d %s' % (i,'x'*args.s) for i in range(args.n)]
+  with SocketClient('localhost',args.p) as client:
+
+    start = time.time()
+    replies = [client.call(cmd) for cmd in cmds]
+    total = time.time()-start
+    assert replies==cmds
+    print 'call():    %8.1f cmds/sec' % (args.n/total)
+
+    start = time.time()
+    futures = [client.submit(cmd) for cmd in cmds]
+    replies = [f.result() for f in futures]
+    total = time.time()-start
+    assert replies==cmds
+    print 'submit():  %8.1f cmds/sec' % (args.n/total)
+
+  srv.stop()
+  srv.join(2)
+
+if __name__=='__main__':
+  main()
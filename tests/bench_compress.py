@@ -0,0 +1,145 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# Measures socket protocol compression for replies of different sizes. A reply
+# thread stands in for the bot and answers each request with that many bytes
+# of a library-style path listing; a client asks for each size with and without
+# negotiating "zlib" and records the bytes it received and the round trip time.
+# The last column adds the time the received bytes would take on a link of the
+# given speed (-l) to the measured local round trip. Usage:
+#
+#   python2 bench_compress.py [-r ROUNDS] [-l MBITS] [-t THRESHOLD] [-p PORT]
+#
+# The bot is imported as "sibyl", so the repo's parent dir must be importable.
+#
+################################################################################
+
+import sys,os,time,socket,argparse,logging,threading
+from Queue import Queue
+from threading import Event
+
+sys.path.insert(0,os.path.abspath(os.path.join(os.path.dirname(__file__),
+    '..','..')))
+
+from sibyl.protocols.sibyl_socket import ServerThread,Connection
+from sibyl.lib.codec import Decoder,Encoder
+
+SIZES = [256,1024,4096,16384,65536,262144,1048576]
+
+def listing(size):
+
+  lines = []
+  total = 0
+  i = 0
+  while total<size:
+    line = '/media/videos/TV/Show %d/Season %02d/Show %d - S%02dE%02d.mkv' % (
+        i/200,i/20%10+1,i/200,i/20%10+1,i%20+1)
+    lines.append(line)
+    total += len(line)+1
+    i += 1
+  return '\n'.join(lines)[:size]
+
+def reply(srv,replies):
+
+  while True:
+    (address,msg,request) = srv.queue.get()
+    srv.send(replies[int(msg)],address)
+
+class Client(object):
+
+  def __init__(self,port,compress):
+
+    self.sock = socket.create_connection(('localhost',port))
+    self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+    self.decoder = Decoder()
+    self.encoder = Encoder()
+    self.wire = 0
+
+    if compress:
+      self.encoder.put('zlib',Connection.MSG_CAPS)
+      self.encoder.send(self.sock)
+      (typ,msg) = self.recv()
+      if msg!=b'zlib':
+        raise RuntimeError('server refused compression')
+
+  def recv(self):
+
+    while True:
+      frames = self.decoder.frames()
+      if frames:
+        return frames[0]
+      n = self.decoder.recv_into(self.sock)
+      if not n:
+        raise RuntimeError('server closed the connection')
+      self.wire += n
+
+  # @return (tuple) bytes received and seconds taken
+  def call(self,size):
+
+    self.wire = 0
+    start = time.time()
+    self.encoder.put(str(size),Connection.MSG_TEXT)
+    self.encoder.send(self.sock)
+    self.recv()
+    return (self.wire,time.time()-start)
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-r',type=int,default=50,help='requests per size')
+  parser.add_argument('-l',type=float,default=10,help='link speed in Mbit/s')
+  parser.add_argument('-t',type=int,default=1024,help='socket.compress value')
+  parser.add_argument('-p',type=int,default=18770,help='port to listen on')
+  args = parser.parse_args()
+
+  log = logging.getLogger('socket')
+  log.addHandler(logging.NullHandler())
+  log.propagate = False
+
+  srv = ServerThread(log,Queue(),Event(),Event(),compress=args.t)
+  srv.bind('localhost',args.p)
+  srv.start()
+  replies = {size:listing(size) for size in SIZES}
+  t = threading.Thread(target=reply,args=(srv,replies))
+  t.daemon = True
+  t.start()
+
+  print '%8s %5s %10s %8s %10s %12s' % (
+      'size','zlib','wire','ratio','p50 ms','link est ms')
+  for size in SIZES:
+    for compress in (False,True):
+      client = Client(args.p,compress)
+      results = sorted([client.call(size) for i in range(args.r)],
+          key=lambda x:x[1])
+      client.sock.close()
+
+      (wire,p50) = results[len(results)/2]
+      link = p50+wire*8/(args.l*1000000)
+      print '%8s %5s %10s %8.2f %10.2f %12.2f' % (size,('no','yes')[compress],
+          wire,float(size)/wire,p50*1000,link*1000)
+
+  srv.stop()
+  srv.join(2)
+
+if __name__=='__main__':
+  main()
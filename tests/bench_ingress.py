@@ -0,0 +1,122 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# Measures how fast SibylBot works through a burst of received messages. Each
+# run starts a real bot with only the socket protocol, dumps a burst of chat
+# commands straight into the protocol's receive queue, and times how long the
+# main loop takes to execute all of them. Usage:
+#
+#   python2 bench_ingress.py [-n MSGS] [-b BUDGET [BUDGET ...]]
+#
+# The bot is imported as "sibyl", so the repo's parent dir must be importable.
+#
+################################################################################
+
+import sys,os,time,argparse,tempfile,shutil,subprocess
+
+sys.path.insert(0,os.path.abspath(os.path.join(os.path.dirname(__file__),
+    '..','..')))
+
+PLUGIN = """
+import time
+from sibyl.lib.decorators import botinit,botcon,botcmd
+
+@botinit
+def init(bot):
+  bot.add_var('bench_count',0)
+  bot.add_var('bench_start',None)
+
+@botcon
+def con(bot,pname):
+  proto = bot.get_protocol(pname)
+  bot.bench_start = time.time()
+  for i in range(%(msgs)s):
+    proto.queue.put((('127.0.0.1',i),'bench',None))
+  proto.event_data.set()
+
+@botcmd
+def bench(bot,mess,args):
+  bot.bench_count += 1
+  if bot.bench_count==%(msgs)s:
+    with open(%(out)r,'w') as f:
+      f.write(str(time.time()-bot.bench_start))
+    bot.quit('bench finished')
+"""
+
+CONF = """
+protocols = socket
+cmd_dir = %(dir)s
+log_file = %(dir)s/sibyl.log
+log_level = error
+persistence = False
+state_file = %(dir)s/state.pickle
+tell_errors = False
+ingress_budget = %(budget)s
+"""
+
+def run_child(conf):
+
+  from sibyl.lib.sibylbot import SibylBot
+  bot = SibylBot(conf)
+  bot.run_forever()
+
+def run_bench(msgs,budget):
+
+  d = tempfile.mkdtemp()
+  try:
+    out = os.path.join(d,'result')
+    with open(os.path.join(d,'bench.py'),'w') as f:
+      f.write(PLUGIN % {'msgs':msgs,'out':out})
+    conf = os.path.join(d,'bench.conf')
+    with open(conf,'w') as f:
+      f.write(CONF % {'dir':d,'budget':budget})
+
+    # each bot gets its own process so logging and sockets start fresh
+    cwd = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+    subprocess.check_call([sys.executable,os.path.abspath(__file__),
+        '--child',conf],cwd=cwd)
+
+    with open(out) as f:
+      return float(f.read())
+  finally:
+    shutil.rmtree(d)
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-n',type=int,default=2000,help='messages per burst')
+  parser.add_argument('-b',type=int,nargs='+',default=[1,20,0],
+      help='ingress_budget values to try (0 = unlimited)')
+  parser.add_argument('--child',help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    return run_child(args.child)
+
+  print '%8s %8s %10s %12s' % ('budget','msgs','seconds','msgs/sec')
+  for budget in args.b:
+    t = run_bench(args.n,budget)
+    print '%8s %8s %10.3f %12.1f' % (budget,args.n,t,args.n/t)
+
+if __name__=='__main__':
+  main()
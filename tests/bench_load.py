@@ -0,0 +1,231 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# Measures end-to-end command throughput and latency of a running bot. Opens
+# CLIENTS connections to the bot's socket protocol, and each one keeps DEPTH
+# commands in flight for SECONDS, picking each command at random from a
+# weighted mix. Prints throughput and p50/p95/p99 latency overall and for each
+# command in the mix. Usage:
+#
+#   python2 bench_load.py [--start] [-c CLIENTS] [-d DEPTH] [-t SECONDS]
+#       [-m WEIGHT:CMD ...] [-n HOST:PORT | -u PATH] [-p PASSWORD] [-s]
+#
+# With --start a bot is started from bench.conf (only the socket protocol plus
+# the general and library plugins, with a made-up library) and stopped at the
+# end; otherwise the bot must already be running. The default mix assumes
+# bench.conf. Before the run we add the alias "bench_search" used by the mix.
+#
+# The bot is imported as "sibyl", so the repo's parent dir must be importable.
+#
+################################################################################
+
+import sys,os,time,random,signal,socket,argparse,subprocess,threading
+
+sys.path.insert(0,os.path.abspath(os.path.join(os.path.dirname(__file__),
+    '..','..')))
+
+from sibyl.lib.socketclient import SocketClient,ClientError
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+CONF = os.path.join(REPO,'tests','bench.conf')
+LIBRARY = os.path.join(REPO,'data','bench_library')
+
+MIX = ['4:hello','3:search show 07 s02','1:help','2:bench_search']
+ALIAS = 'alias add bench_search search show 12 s01'
+
+def make_library():
+  """create a fake TV library for bench.conf if it isn't there yet"""
+
+  if os.path.isdir(LIBRARY):
+    return
+  for show in range(50):
+    for season in range(1,5):
+      d = os.path.join(LIBRARY,'Show %02d' % show,'Season %d' % season)
+      os.makedirs(d)
+      for ep in range(1,11):
+        name = 'Show %02d - S%02dE%02d.mkv' % (show,season,ep)
+        open(os.path.join(d,name),'w').close()
+
+# @return (Popen) the bot process once it's accepting connections
+def start_bot(port):
+
+  make_library()
+  with open(os.devnull,'w') as null:
+    proc = subprocess.Popen([sys.executable,os.path.join(REPO,'run.py'),
+        '-c',CONF],stdout=null,stderr=null)
+
+  start = time.time()
+  while time.time()-start<60:
+    if proc.poll() is not None:
+      raise RuntimeError('bot exited; see data/bench.log')
+    try:
+      socket.create_connection(('localhost',port),1).close()
+      return proc
+    except socket.error:
+      time.sleep(0.2)
+  proc.kill()
+  raise RuntimeError('bot never started listening')
+
+# @param mix (list of str) "WEIGHT:CMD" or just "CMD"
+# @return (list of tuple) (cumulative weight,cmd)
+def parse_mix(mix):
+
+  (table,total) = ([],0)
+  for item in mix:
+    (weight,_,cmd) = item.partition(':')
+    if not (cmd and weight.isdigit()):
+      (weight,cmd) = ('1',item)
+    total += int(weight)
+    table.append((total,cmd))
+  return table
+
+class Driver(object):
+
+  # @param client (SocketClient) a connected client
+  # @param mix (list of tuple) from parse_mix()
+  # @param depth (int) commands to keep in flight
+  # @param seed (int) for picking commands
+  def __init__(self,client,mix,depth,seed):
+
+    self.client = client
+    self.mix = mix
+    self.depth = depth
+    self.random = random.Random(seed)
+    self.lock = threading.Lock()
+    self.done = threading.Event()
+    self.stop = None
+    self.flight = 0
+    self.times = []
+    self.errors = 0
+
+  # @param stop (float) time.time() after which no new commands are sent
+  def start(self,stop):
+
+    self.stop = stop
+    for i in range(self.depth):
+      self.next()
+
+  def next(self):
+    """send another command unless it's time to stop"""
+
+    if time.time()>=self.stop:
+      with self.lock:
+        if not self.flight:
+          self.done.set()
+      return
+
+    n = self.random.randint(1,self.mix[-1][0])
+    cmd = [c for (w,c) in self.mix if w>=n][0]
+    with self.lock:
+      self.flight += 1
+    start = time.time()
+    try:
+      future = self.client.submit(cmd)
+    except ClientError:
+      self.errors += 1
+      self.done.set()
+      return
+    future.add_done_callback(lambda f: self.finish(f,cmd,start))
+
+  def finish(self,future,cmd,start):
+
+    now = time.time()
+    with self.lock:
+      self.flight -= 1
+    if future.exception():
+      self.errors += 1
+      self.done.set()
+    else:
+      self.times.append((cmd,now-start))
+      self.next()
+
+def percentile(times,p):
+
+  return times[min(int(len(times)*p/100.0),len(times)-1)]
+
+def report(name,times,total):
+
+  times = sorted(times)
+  print '%-28s %7s %9.1f %8.2f %8.2f %8.2f %8.2f' % (name[:28],len(times),
+      len(times)/total,percentile(times,50)*1000,percentile(times,95)*1000,
+      percentile(times,99)*1000,times[-1]*1000)
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--start',action='store_true',
+      help='start a bot with bench.conf (and stop it afterwards)')
+  parser.add_argument('-c',type=int,default=10,help='concurrent clients')
+  parser.add_argument('-d',type=int,default=1,help='commands in flight each')
+  parser.add_argument('-t',type=float,default=10,help='seconds to run')
+  parser.add_argument('-m',action='append',metavar='WEIGHT:CMD',
+      help='add a command to the mix (default %s)' % ' '.join(MIX))
+  parser.add_argument('-n',default='localhost:18780',help='host:port')
+  parser.add_argument('-u',default=None,help='Unix socket to connect to')
+  parser.add_argument('-p',default=None,help='socket.password')
+  parser.add_argument('-s',action='store_true',help='use ssl (no verify)')
+  parser.add_argument('--seed',type=int,default=0,help='random seed')
+  args = parser.parse_args()
+
+  (host,port) = args.n.split(':')
+  port = int(port)
+  proc = start_bot(port) if args.start else None
+
+  try:
+    clients = [SocketClient(host,port,args.u,args.p,args.s,False)
+        for i in range(args.c)]
+    for c in clients:
+      c.connect()
+    clients[0].call(ALIAS,30)
+
+    mix = parse_mix(args.m or MIX)
+    drivers = [Driver(c,mix,args.d,args.seed+i) for (i,c) in enumerate(clients)]
+    start = time.time()
+    for d in drivers:
+      d.start(start+args.t)
+    for d in drivers:
+      d.done.wait(args.t+60)
+    total = time.time()-start
+
+    for c in clients:
+      c.close()
+  finally:
+    if proc:
+      proc.send_signal(signal.SIGTERM)
+      proc.wait()
+
+  times = sum([d.times for d in drivers],[])
+  if not times:
+    print 'No replies received'
+    sys.exit(1)
+
+  print 'clients: %s  depth: %s  seconds: %.1f  errors: %s' % (
+      args.c,args.d,total,sum([d.errors for d in drivers]))
+  print '%-28s %7s %9s %8s %8s %8s %8s' % (
+      'command','count','cmds/sec','p50 ms','p95 ms','p99 ms','max ms')
+  for (w,cmd) in mix:
+    report(cmd,[t for (c,t) in times if c==cmd],total)
+  report('TOTAL',[t for (c,t) in times],total)
+
+if __name__=='__main__':
+  main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# Measures the socket protocol's ServerThread on its own (no SibylBot). An
+# echo thread stands in for the bot and sends every received message straight
+# back, while a single-threaded driver in a separate process keeps many local
+# clients doing round trips and records the latency of each one. With -d each
+# client keeps DEPTH tagged requests in flight instead of waiting for every
+# reply before sending the next message. With -u the clients connect to a Unix
+# domain socket at PATH instead of TCP. Usage:
+#
+#   python2 bench_socket.py [-c CLIENTS] [-r ROUNDS] [-s SIZE] [-d DEPTH]
+#       [-p PORT] [-u PATH]
+#
+# The bot is imported as "sibyl", so the repo's parent dir must be importable.
+#
+################################################################################
+
+import sys,os,time,socket,select,errno,argparse,logging,resource,threading
+import multiprocessing
+from collections import deque
+from Queue import Queue
+from threading import Event
+
+sys.path.insert(0,os.path.abspath(os.path.join(os.path.dirname(__file__),
+    '..','..')))
+
+from sibyl.protocols.sibyl_socket import ServerThread
+
+def frame(msg,typ='1'):
+
+  msg = typ+' '+msg
+  return str(len(msg))+' '+msg
+
+class Client(object):
+
+  def __init__(self,port,msg,rounds,depth,unix=None):
+
+    if unix:
+      self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+      self.sock.connect(unix)
+    else:
+      self.sock = socket.create_connection(('localhost',port))
+    self.sock.setblocking(0)
+    self.msg = msg
+    self.rounds = rounds
+    self.depth = depth
+    self.buf = bytearray()
+    self.times = []
+    self.sent = deque()
+    self.count = 0
+
+    # every request ID has the same length so every reply has the same size
+    self.expect = len(self.frame())
+
+  def frame(self):
+
+    if not self.depth:
+      return frame(self.msg)
+    return frame('%08d %s' % (self.count,self.msg),'2')
+
+  def start(self):
+
+    for i in range(max(self.depth,1)):
+      self.send()
+
+  def send(self):
+
+    if self.count>=self.rounds:
+      return
+    data = self.frame()
+    self.count += 1
+
+    # block while sending in case the message is bigger than the socket buffer
+    self.sent.append(time.time())
+    self.sock.setblocking(1)
+    self.sock.sendall(data)
+    self.sock.setblocking(0)
+
+  # @return (bool) True when this client has finished all of its rounds
+  def read(self):
+
+    try:
+      s = self.sock.recv(65536)
+    except socket.error as e:
+      if e.errno in (errno.EAGAIN,errno.EWOULDBLOCK):
+        return False
+      raise
+    if not s:
+      raise RuntimeError('server closed the connection')
+
+    self.buf += s
+    # the server answers in order, so replies match the oldest request
+    while len(self.buf)>=self.expect:
+      del self.buf[:self.expect]
+      self.times.append(time.time()-self.sent.popleft())
+      if len(self.times)>=self.rounds:
+        return True
+      self.send()
+    return False
+
+def drive(args,pipe):
+
+  start = time.time()
+  clients = [Client(args.p,'x'*args.s,args.r,args.d,args.u)
+      for i in range(args.c)]
+  connect = time.time()-start
+
+  poller = select.epoll()
+  fds = {}
+  for c in clients:
+    fds[c.sock.fileno()] = c
+    poller.register(c.sock.fileno(),select.EPOLLIN)
+
+  start = time.time()
+  for c in clients:
+    c.start()
+  while fds:
+    for (fd,event) in poller.poll(5):
+      if fds[fd].read():
+        poller.unregister(fd)
+        del fds[fd]
+  total = time.time()-start
+
+  pipe.send((connect,total,sum([c.times for c in clients],[])))
+
+def echo(srv):
+
+  while True:
+    (address,msg,request) = srv.queue.get()
+    srv.send(msg,address,request)
+
+def percentile(times,p):
+
+  return times[min(int(len(times)*p/100.0),len(times)-1)]
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-c',type=int,default=1000,help='concurrent clients')
+  parser.add_argument('-r',type=int,default=10,help='round trips per client')
+  parser.add_argument('-s',type=int,default=32,help='message size in bytes')
+  parser.add_argument('-d',type=int,default=0,
+      help='requests in flight per client (0 = untagged, one at a time)')
+  parser.add_argument('-p',type=int,default=18767,help='port to listen on')
+  parser.add_argument('-u',default=None,help='Unix socket to listen on')
+  args = parser.parse_args()
+
+  # every client needs two file descriptors (ours and the server's)
+  (soft,hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+  want = min(hard,2*args.c+64)
+  if soft<want:
+    resource.setrlimit(resource.RLIMIT_NOFILE,(want,hard))
+
+  log = logging.getLogger('socket')
+  log.addHandler(logging.NullHandler())
+  log.propagate = False
+
+  srv = ServerThread(log,Queue(),Event(),Event())
+  srv.bind('localhost',args.p)
+  if args.u:
+    srv.bind_unix(args.u)
+  srv.start()
+  t = threading.Thread(target=echo,args=(srv,))
+  t.daemon = True
+  t.start()
+
+  # the clients get their own process so they don't fight the server for CPU
+  (recv,send) = multiprocessing.Pipe(False)
+  proc = multiprocessing.Process(target=drive,args=(args,send))
+  proc.start()
+  (connect,total,times) = recv.recv()
+  proc.join()
+
+  times = sorted(times)
+  print 'clients:   %s' % args.c
+  print 'rounds:    %s' % args.r
+  print 'depth:     %s' % args.d
+  print 'connect:   %.3f sec' % connect
+  print 'total:     %.3f sec' % total
+  print 'msgs/sec:  %.1f' % (len(times)/total)
+  for p in (50,95,99):
+    print 'p%s:       %.2f ms' % (p,percentile(times,p)*1000)
+
+  # older servers only poll event_close, newer ones need waking up
+  getattr(srv,'stop',srv.event_close.set)()
+  srv.join(2)
+
+if __name__=='__main__':
+  main()
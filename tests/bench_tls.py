@@ -0,0 +1,143 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Sibyl: A modular Python chat bot framework
+# Copyright (c) 2015-2017 Joshua Haas <jahschwa.com>
+#
+# This file is part of Sibyl.
+#
+# Sibyl is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+#
+# Measures what TLS session resumption saves short-lived socket clients like
+# "client.py -e". A reply thread stands in for the bot, and a client in a
+# separate process opens one SSL connection per round, sends a message, waits
+# for the reply and disconnects, with and without a SessionCache. It records
+# the time from connect() to the first reply, and the CPU time the server
+# process spent per connection. Usage:
+#
+#   python2 bench_tls.py -k PRIVKEY -c PUBKEY [-r ROUNDS] [-p PORT]
+#
+# The bot is imported as "sibyl", so the repo's parent dir must be importable.
+#
+################################################################################
+
+import sys,os,time,socket,ssl,argparse,logging,tempfile,threading
+import multiprocessing
+from Queue import Queue
+from threading import Event
+
+sys.path.insert(0,os.path.abspath(os.path.join(os.path.dirname(__file__),
+    '..','..')))
+
+from sibyl.protocols.sibyl_socket import ServerThread,Connection
+from sibyl.lib.codec import Decoder,encode
+from sibyl.lib.tlscache import SessionCache
+
+def reply(srv):
+
+  while True:
+    (address,msg,request) = srv.queue.get()
+    srv.send('hello',address)
+
+# @return (tuple) seconds until the first reply, and if the session was resumed
+def call(port,cache):
+
+  start = time.time()
+  context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+  sock = context.wrap_socket(socket.socket(),do_handshake_on_connect=False)
+  sock.connect(('localhost',port))
+  if cache:
+    cache.load(sock,'bench')
+  sock.do_handshake()
+
+  sock.sendall(b''.join(encode('hello',Connection.MSG_TEXT)))
+  decoder = Decoder()
+  while not decoder.frames():
+    if not decoder.recv_into(sock):
+      raise RuntimeError('server closed the connection')
+  elapsed = time.time()-start
+
+  reused = bool(cache and cache.reused(sock))
+  if cache:
+    cache.save(sock,'bench')
+  sock.close()
+  return (elapsed,reused)
+
+def drive(args,resume,pipe):
+
+  cache = None
+  if resume:
+    (fd,path) = tempfile.mkstemp()
+    os.close(fd)
+    cache = SessionCache(path)
+    if not cache.enabled():
+      raise RuntimeError('sessions not supported by this python')
+    call(args.p,cache)
+
+  results = [call(args.p,cache) for i in range(args.r)]
+  if resume:
+    os.remove(path)
+  pipe.send(results)
+
+def percentile(times,p):
+
+  return times[min(int(len(times)*p/100.0),len(times)-1)]
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-k',required=True,help='private key file')
+  parser.add_argument('-c',required=True,help='certificate file')
+  parser.add_argument('-r',type=int,default=200,help='connections per mode')
+  parser.add_argument('-p',type=int,default=18771,help='port to listen on')
+  args = parser.parse_args()
+
+  log = logging.getLogger('socket')
+  log.addHandler(logging.NullHandler())
+  log.propagate = False
+
+  context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+  context.verify_mode = ssl.CERT_NONE
+  context.load_cert_chain(certfile=args.c,keyfile=args.k)
+
+  srv = ServerThread(log,Queue(),Event(),Event(),ssl=context)
+  srv.bind('localhost',args.p)
+  srv.start()
+  t = threading.Thread(target=reply,args=(srv,))
+  t.daemon = True
+  t.start()
+
+  print '%8s %8s %10s %10s %14s' % (
+      'mode','resumed','p50 ms','p95 ms','server cpu ms')
+  for resume in (False,True):
+    (recv,send) = multiprocessing.Pipe(False)
+    proc = multiprocessing.Process(target=drive,args=(args,resume,send))
+    cpu = sum(os.times()[:2])
+    proc.start()
+    results = recv.recv()
+    proc.join()
+    cpu = sum(os.times()[:2])-cpu
+
+    times = sorted([x[0] for x in results])
+    print '%8s %8s %10.2f %10.2f %14.2f' % (('full','resume')[resume],
+        sum([x[1] for x in results]),percentile(times,50)*1000,
+        percentile(times,95)*1000,cpu*1000/len(results))
+
+  srv.stop()
+  srv.join(2)
+
+if __name__=='__main__':
+  main()